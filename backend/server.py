@@ -1,18 +1,40 @@
 from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Header, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument, WriteConcern, ReplaceOne, UpdateOne
+from bson import ObjectId
+from bson.binary import Binary
+from bson.errors import InvalidId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
+from urllib.parse import quote
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone, timedelta, date as date_cls
 import bcrypt
 import jwt
 import io
+import csv
+import zlib
+import asyncio
+import time
+import bisect
+import heapq
+import json
+import re
+import unicodedata
+import sys
+import threading
+import traceback
+import weakref
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from zoneinfo import ZoneInfo
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -26,6 +48,61 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'gatekeeper-secret-key-2024')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+# Multi-site: every gate record belongs to one site (plant)
+DEFAULT_SITE_ID = os.environ.get('DEFAULT_SITE_ID', 'default')
+
+# Local gate time: schedules are entered as local date/time
+GATE_TIMEZONE = ZoneInfo(os.environ.get('GATE_TIMEZONE', 'America/Sao_Paulo'))
+REMINDER_LEAD_MINUTES = int(os.environ.get('REMINDER_LEAD_MINUTES', '15'))
+
+# Closed-day report snapshots
+SNAPSHOT_DELAY_MINUTES = int(os.environ.get('SNAPSHOT_DELAY_MINUTES', '15'))
+SNAPSHOT_REFREEZE_DELAY_SECONDS = int(os.environ.get('SNAPSHOT_REFREEZE_DELAY_SECONDS', '30'))
+SNAPSHOT_BACKFILL_DAYS = int(os.environ.get('SNAPSHOT_BACKFILL_DAYS', '7'))
+ON_TIME_GRACE_MINUTES = int(os.environ.get('ON_TIME_GRACE_MINUTES', '15'))
+
+# Write path tuning
+# Unset keeps the concern inherited from MONGO_URL / the server default
+WRITE_CONCERN_W = os.environ.get('WRITE_CONCERN_W')
+WRITE_CONCERN_J = os.environ.get('WRITE_CONCERN_J')
+WRITE_COALESCING = os.environ.get('WRITE_COALESCING', 'false').lower() == 'true'
+WRITE_COALESCING_MAX_BATCH = int(os.environ.get('WRITE_COALESCING_MAX_BATCH', '100'))
+WRITE_COALESCING_MAX_DELAY_MS = float(os.environ.get('WRITE_COALESCING_MAX_DELAY_MS', '5'))
+
+# Online migration to the compact document layout
+SCHEMA_MIGRATION = os.environ.get('SCHEMA_MIGRATION', 'true').lower() == 'true'
+SCHEMA_MIGRATION_BATCH = int(os.environ.get('SCHEMA_MIGRATION_BATCH', '500'))
+SCHEMA_MIGRATION_PAUSE_MS = float(os.environ.get('SCHEMA_MIGRATION_PAUSE_MS', '50'))
+
+# Auth admission (login brute-force / CPU protection)
+AUTH_IP_RATE_PER_MIN = float(os.environ.get('AUTH_IP_RATE_PER_MIN', '30'))
+AUTH_IP_BURST = int(os.environ.get('AUTH_IP_BURST', '10'))
+AUTH_USER_RATE_PER_MIN = float(os.environ.get('AUTH_USER_RATE_PER_MIN', '10'))
+AUTH_USER_BURST = int(os.environ.get('AUTH_USER_BURST', '5'))
+AUTH_MAX_CONCURRENT_HASHES = int(os.environ.get('AUTH_MAX_CONCURRENT_HASHES', '2'))
+# Reverse proxies in front of the API that append to X-Forwarded-For (0 = use the socket peer)
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+
+# Admission lanes for heavy routes (check-in, checkout and return are never queued)
+LANE_EXPORT_CONCURRENCY = int(os.environ.get('LANE_EXPORT_CONCURRENCY', '2'))
+LANE_EXPORT_QUEUE = int(os.environ.get('LANE_EXPORT_QUEUE', '4'))
+LANE_REPORT_CONCURRENCY = int(os.environ.get('LANE_REPORT_CONCURRENCY', '3'))
+LANE_REPORT_QUEUE = int(os.environ.get('LANE_REPORT_QUEUE', '8'))
+LANE_SEARCH_CONCURRENCY = int(os.environ.get('LANE_SEARCH_CONCURRENCY', '4'))
+LANE_SEARCH_QUEUE = int(os.environ.get('LANE_SEARCH_QUEUE', '16'))
+LANE_BULK_CONCURRENCY = int(os.environ.get('LANE_BULK_CONCURRENCY', '2'))
+LANE_BULK_QUEUE = int(os.environ.get('LANE_BULK_QUEUE', '2'))
+LANE_MAX_WAIT_SECONDS = float(os.environ.get('LANE_MAX_WAIT_SECONDS', '10'))
+
+# Event-loop lag watchdog
+LOOP_LAG_INTERVAL_MS = float(os.environ.get('LOOP_LAG_INTERVAL_MS', '100'))
+LOOP_LAG_THRESHOLD_MS = float(os.environ.get('LOOP_LAG_THRESHOLD_MS', '250'))
+
+# Visitor / fleet attachments (GridFS) and their thumbnails
+ATTACHMENT_MAX_BYTES = int(float(os.environ.get('ATTACHMENT_MAX_MB', '10')) * 1024 * 1024)
+THUMBNAIL_CACHE_BYTES = int(float(os.environ.get('THUMBNAIL_CACHE_MB', '32')) * 1024 * 1024)
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', '2'))
+
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
@@ -40,12 +117,14 @@ class UserCreate(BaseModel):
     password: str
     name: str
     role: str = "porteiro"
+    site_id: Optional[str] = None
 
 class UserUpdate(BaseModel):
     username: Optional[str] = None
     password: Optional[str] = None
     name: Optional[str] = None
     role: Optional[str] = None
+    site_id: Optional[str] = None
 
 class LoginRequest(BaseModel):
     username: str
@@ -60,12 +139,20 @@ class VisitorCreate(BaseModel):
     observation: Optional[str] = ""
     invoice: Optional[str] = ""
 
+class ScheduleRecurrence(BaseModel):
+    frequency: str  # daily | weekly | custom
+    interval: int = 1
+    weekdays: List[int] = []  # 0 = segunda-feira
+    dates: List[str] = []  # custom: explicit YYYY-MM-DD dates
+    until: Optional[str] = None
+
 class ScheduleCreate(BaseModel):
     visitor_name: str
     company: Optional[str] = ""
     visit_date: str
     visit_time: str
     notes: Optional[str] = ""
+    recurrence: Optional[ScheduleRecurrence] = None
 
 class FleetTripCreate(BaseModel):
     driver_name: str
@@ -94,12 +181,98 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
-def create_token(user_id: str, username: str, role: str, name: str) -> str:
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, capacity: int):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.stamp = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self) -> int:
+        return max(1, int((1 - self.tokens) / self.rate) + 1)
+
+class AuthAdmission:
+    """Rejects excess auth attempts before any bcrypt work is done and caps
+    how many hashes run at once, so a login flood cannot starve the gate."""
+
+    MAX_TRACKED_KEYS = 10000
+
+    def __init__(self):
+        self.ip_buckets = OrderedDict()
+        self.user_buckets = OrderedDict()
+        self.active_hashes = 0
+        self.stats = {"admitted": 0, "rejected_ip": 0, "rejected_user": 0, "rejected_busy": 0, "peak_hashes": 0}
+
+    def _bucket(self, buckets: OrderedDict, key: str, rate_per_min: float, burst: int) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate_per_min / 60, burst)
+            if len(buckets) > self.MAX_TRACKED_KEYS:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def admit(self, ip: str, username: Optional[str] = None):
+        bucket = self._bucket(self.ip_buckets, ip, AUTH_IP_RATE_PER_MIN, AUTH_IP_BURST)
+        if not bucket.take():
+            self.stats["rejected_ip"] += 1
+            raise HTTPException(status_code=429, detail="Muitas tentativas, aguarde", headers={"Retry-After": str(bucket.retry_after())})
+        if username:
+            bucket = self._bucket(self.user_buckets, username.strip().lower(), AUTH_USER_RATE_PER_MIN, AUTH_USER_BURST)
+            if not bucket.take():
+                self.stats["rejected_user"] += 1
+                raise HTTPException(status_code=429, detail="Muitas tentativas, aguarde", headers={"Retry-After": str(bucket.retry_after())})
+        self.stats["admitted"] += 1
+
+    async def run_hash(self, fn, *args):
+        """Run a bcrypt call in a worker thread, or fail fast if all slots are busy."""
+        if self.active_hashes >= AUTH_MAX_CONCURRENT_HASHES:
+            self.stats["rejected_busy"] += 1
+            raise HTTPException(status_code=503, detail="Servidor ocupado, tente novamente", headers={"Retry-After": "1"})
+        self.active_hashes += 1
+        self.stats["peak_hashes"] = max(self.stats["peak_hashes"], self.active_hashes)
+        try:
+            return await asyncio.to_thread(fn, *args)
+        finally:
+            self.active_hashes -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "active_hashes": self.active_hashes,
+            "max_concurrent_hashes": AUTH_MAX_CONCURRENT_HASHES,
+            "tracked_ips": len(self.ip_buckets),
+            "tracked_usernames": len(self.user_buckets)
+        }
+
+auth_admission = AuthAdmission()
+
+def client_ip(request: Request) -> str:
+    """Peer address, or the hop recorded by the outermost of TRUSTED_PROXY_HOPS
+    reverse proxies. Entries left of that are client-supplied and ignored."""
+    peer = request.client.host if request.client else "unknown"
+    if TRUSTED_PROXY_HOPS <= 0:
+        return peer
+    hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    return hops[-TRUSTED_PROXY_HOPS] if len(hops) >= TRUSTED_PROXY_HOPS else peer
+
+def create_token(user_id: str, username: str, role: str, name: str, site_id: str) -> str:
     payload = {
         "user_id": user_id,
         "username": username,
         "role": role,
         "name": name,
+        "site_id": site_id,
         "exp": datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
@@ -114,46 +287,1232 @@ async def get_current_user(request: Request):
         if token.startswith("Bearer "):
             token = token[7:]
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expirado")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Token inválido")
+    # Tokens issued before sites existed belong to the default site
+    payload.setdefault("site_id", DEFAULT_SITE_ID)
+    # Admins may act on another site; EventSource cannot send headers, hence the query param
+    requested = request.headers.get("x-site-id") or request.query_params.get("site_id")
+    if requested and requested != payload["site_id"]:
+        if payload["role"] != "admin":
+            raise HTTPException(status_code=403, detail="Acesso negado a esta unidade")
+        payload["site_id"] = requested
+    return payload
+
+# ─── Sync Helpers ─────────────────────────────────────────────────────
+
+SYNC_COLLECTIONS = ("visitors", "fleet_trips", "schedules", "schedule_series", "schedule_overrides")
+SYNC_BACKFILL_BATCH = 1000
+
+class VersionReservations:
+    """Sync versions handed to writes that have not committed yet.
+
+    Versions are reserved before the write, so v11 can commit while v10 is
+    still in flight. Readers cap their checkpoint below the oldest open
+    reservation; otherwise a terminal would resume after v11 and never see v10.
+    """
+
+    def __init__(self):
+        self.highest = 0
+        self.open = {}
+
+    def ceiling(self, version: int) -> int:
+        """Highest checkpoint that is safe to hand out, given `version` was read."""
+        if not self.open:
+            return version
+        return min(version, min(self.open.values()) - 1)
+
+version_reservations = VersionReservations()
+
+async def next_version(count: int = 1) -> int:
+    """Increment the counter by `count` and return the highest new version."""
+    counter = await db.counters.find_one_and_update(
+        {"_id": "sync_version"},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    version_reservations.highest = max(version_reservations.highest, counter["seq"])
+    return counter["seq"]
+
+@asynccontextmanager
+async def reserve_versions(count: int = 1):
+    """Reserve `count` consecutive versions and yield the highest one; keep
+    the block open until the write that uses them has committed."""
+    token = object()
+    # Until the increment returns, the reservation can be anything above what we have seen
+    version_reservations.open[token] = version_reservations.highest + 1
+    try:
+        last = await next_version(count)
+        version_reservations.open[token] = last - count + 1
+        yield last
+    finally:
+        del version_reservations.open[token]
+
+@asynccontextmanager
+async def sync_stamp():
+    """Fields every write to a synced collection must $set, reserved until the block exits."""
+    async with reserve_versions() as version:
+        yield {"updated_at": now_iso(), "version": version}
+
+async def record_deletion(collection: str, doc_id: str, site_id: str):
+    async with sync_stamp() as stamp:
+        await db.sync_tombstones.insert_one({"collection": collection, "id": doc_id, "site_id": site_id, **stamp})
+
+async def record_deletions(collection: str, doc_ids: list, site_id: str):
+    """Tombstones for several deleted records under one version reservation."""
+    if not doc_ids:
+        return
+    async with reserve_versions(len(doc_ids)) as last:
+        first, updated_at = last - len(doc_ids) + 1, now_iso()
+        await db.sync_tombstones.insert_many([
+            {"collection": collection, "id": doc_id, "site_id": site_id, "updated_at": updated_at, "version": first + i}
+            for i, doc_id in enumerate(doc_ids)
+        ])
+
+async def backfill_sync_versions():
+    """Version records written before sync: one counter increment and one
+    bulk_write per batch of SYNC_BACKFILL_BATCH documents."""
+    unversioned = {"version": {"$exists": False}}
+    for name in SYNC_COLLECTIONS:
+        while True:
+            batch = await db[name].find(unversioned, {"_id": 1, "created_at": 1}).to_list(SYNC_BACKFILL_BATCH)
+            if not batch:
+                break
+            async with reserve_versions(len(batch)) as last:
+                first = last - len(batch) + 1
+                await db[name].bulk_write([
+                    UpdateOne(
+                        {"_id": doc["_id"], **unversioned},
+                        {"$set": {"updated_at": doc.get("created_at") or now_iso(), "version": first + i}}
+                    )
+                    for i, doc in enumerate(batch)
+                ], ordered=False)
+    counter = await db.counters.find_one({"_id": "sync_version"})
+    version_reservations.highest = max(version_reservations.highest, counter["seq"] if counter else 0)
+
+# ─── Sites ────────────────────────────────────────────────────────────
+
+SITE_COLLECTIONS = SYNC_COLLECTIONS + ("sync_tombstones", "report_observations", "report_snapshots", "visitor_profiles", "users")
+
+# Single-field indexes from before sites; their site-prefixed replacements are created at startup
+SUPERSEDED_INDEXES = {
+    "visitors": ("entry_time_1", "id_1", "version_1"),
+    "fleet_trips": ("created_at_1", "id_1", "version_1"),
+    "schedules": ("visit_date_1", "visit_date_1_status_1_visit_time_1", "version_1"),
+    "schedule_series": ("visit_date_1", "version_1"),
+    "schedule_overrides": ("version_1",),
+    "sync_tombstones": ("version_1",),
+    "report_snapshots": ("date_1",),
+    "visitor_profiles": ("document_key_1",),
+}
+
+async def backfill_site_ids():
+    """Records written before sites existed belong to DEFAULT_SITE_ID."""
+    for name in SITE_COLLECTIONS:
+        result = await db[name].update_many({"site_id": {"$exists": False}}, {"$set": {"site_id": DEFAULT_SITE_ID}})
+        if result.modified_count:
+            logger.info(f"{name}: {result.modified_count} registros atribuídos à unidade {DEFAULT_SITE_ID}")
+
+async def drop_superseded_indexes():
+    for name, indexes in SUPERSEDED_INDEXES.items():
+        existing = await db[name].index_information()
+        for index in indexes:
+            if index in existing:
+                try:
+                    await db[name].drop_index(index)
+                except OperationFailure as e:
+                    logger.error(f"Falha ao remover índice {name}.{index}: {e}")
+
+async def known_sites() -> list:
+    """Every site with users or gate activity (distinct over site-prefixed indexes)."""
+    sites = {DEFAULT_SITE_ID}
+    for name in ("users", "visitors", "fleet_trips", "schedules", "schedule_series"):
+        sites.update(await db[name].distinct("site_id"))
+    return sorted(sites)
+
+# ─── Compact Schema ───────────────────────────────────────────────────
+#
+# visitors and fleet_trips are stored in a compact layout (schema_version 3):
+# native dates, UUID ids as BSON binary, small status codes, and optional
+# fields omitted when empty. BSON dates hold milliseconds, so the microseconds
+# below that go to `date_micros`. encode_document/decode_document translate
+# at the collection boundary so the API keeps returning the original shape,
+# and the query helpers match both layouts while the online migrator is
+# running. Version 2 documents (no `date_micros`) decode the same way.
+
+COMPACT_SCHEMA_VERSION = 3
+COMPACT_COLLECTIONS = ("visitors", "fleet_trips")
+COMPACT_DATE_FIELDS = ("entry_time", "exit_time", "created_at", "updated_at")
+COMPACT_DEFAULTS = {
+    "visitors": {"exit_time": None, "vehicle_plate": "", "company": "", "observation": "", "invoice": ""},
+    "fleet_trips": {"destination": "", "invoice": "", "arrival_km": None, "distance": None}
+}
+COMPACT_FIELD_ORDER = {
+    "visitors": ("id", "name", "document", "entry_time", "exit_time", "vehicle_plate", "company",
+                 "observation", "invoice", "created_at"),
+    "fleet_trips": ("id", "driver_name", "vehicle", "departure_km", "destination", "invoice",
+                    "arrival_km", "distance", "status", "created_at")
+}
+FLEET_STATUS_CODES = {"em_viagem": 0, "retornado": 1}
+FLEET_STATUS_NAMES = {code: name for name, code in FLEET_STATUS_CODES.items()}
+
+def to_utc_iso(value: datetime) -> str:
+    # Mongo returns naive UTC datetimes
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
+
+def now_iso() -> str:
+    """Current UTC time at BSON (millisecond) precision, so it stores as a native date losslessly."""
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000).isoformat()
+
+def storable_date(value: str) -> Optional[tuple]:
+    """(native date, sub-millisecond microseconds) for a UTC isoformat
+    string, which decode_document renders back byte for byte; anything else
+    - local offsets, 'Z', naive strings - stays a string."""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.utcoffset() != timedelta(0) or parsed.isoformat() != value:
+        return None
+    micros = parsed.microsecond % 1000
+    return parsed - timedelta(microseconds=micros), micros
+
+def encode_fields(collection: str, fields: dict) -> dict:
+    """Convert API values to their compact storage form (no omission)."""
+    out = {}
+    micros = {}
+    for key, value in fields.items():
+        if key in COMPACT_DATE_FIELDS and isinstance(value, str):
+            stored = storable_date(value)
+            if stored:
+                value, micros[key] = stored
+        elif key == "id" and isinstance(value, str):
+            try:
+                value = Binary.from_uuid(uuid.UUID(value))
+            except ValueError:
+                pass
+        elif key == "status" and collection == "fleet_trips":
+            value = FLEET_STATUS_CODES.get(value, value)
+        out[key] = value
+    micros = {k: v for k, v in micros.items() if v}
+    if micros:
+        out["date_micros"] = micros
+    return out
+
+def encode_update(collection: str, fields: dict) -> dict:
+    """Update document setting `fields` in either layout; clears the
+    sub-millisecond remainder of dates that are rewritten without one."""
+    out = encode_fields(collection, fields)
+    micros = out.pop("date_micros", {})
+    update = {"$set": {**out, **{f"date_micros.{k}": v for k, v in micros.items()}}}
+    cleared = [k for k in fields if k in COMPACT_DATE_FIELDS and k not in micros]
+    if cleared:
+        update["$unset"] = {f"date_micros.{k}": "" for k in cleared}
+    return update
+
+def encode_document(collection: str, doc: dict) -> dict:
+    if collection not in COMPACT_COLLECTIONS:
+        return doc
+    defaults = COMPACT_DEFAULTS[collection]
+    doc = {k: v for k, v in doc.items() if not (k in defaults and v in ("", None))}
+    if collection == "visitors" and doc.get("created_at") is not None and doc.get("created_at") == doc.get("entry_time"):
+        # created_at is implied by entry_time unless the porter back-dated the entry
+        del doc["created_at"]
+    out = encode_fields(collection, doc)
+    out["schema_version"] = COMPACT_SCHEMA_VERSION
+    return out
+
+def decode_document(collection: str, doc: Optional[dict]) -> Optional[dict]:
+    """Stored document (either layout, possibly projected) to API shape."""
+    if doc is None or collection not in COMPACT_COLLECTIONS:
+        return doc
+    doc = dict(doc)
+    compact = doc.pop("schema_version", 0) >= 2
+    micros = doc.pop("date_micros", None) or {}
+    for key, value in doc.items():
+        if isinstance(value, datetime):
+            doc[key] = to_utc_iso(value + timedelta(microseconds=micros.get(key, 0)))
+        elif key == "id" and isinstance(value, Binary):
+            doc[key] = str(value.as_uuid())
+        elif key == "id" and isinstance(value, uuid.UUID):
+            doc[key] = str(value)
+        elif key == "status" and collection == "fleet_trips":
+            doc[key] = FLEET_STATUS_NAMES.get(value, value)
+    if not compact:
+        return doc
+    for key, value in COMPACT_DEFAULTS[collection].items():
+        doc.setdefault(key, value)
+    if collection == "visitors" and "entry_time" in doc:
+        doc.setdefault("created_at", doc["entry_time"])
+    order = COMPACT_FIELD_ORDER[collection]
+    ordered = {k: doc[k] for k in order if k in doc}
+    ordered.update((k, v) for k, v in doc.items() if k not in ordered)
+    return ordered
+
+def id_filter(doc_id: str) -> dict:
+    values = [doc_id]
+    try:
+        values.append(Binary.from_uuid(uuid.UUID(doc_id)))
+    except ValueError:
+        pass
+    return {"id": {"$in": values}}
+
+def day_filter(field: str, date: str) -> dict:
+    """Match a UTC day on a timestamp stored either as ISO string or native date."""
+    try:
+        start = datetime.fromisoformat(date).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return {field: {"$regex": f"^{re.escape(date)}"}}
+    return {"$or": [
+        {field: {"$regex": f"^{date}"}},
+        {field: {"$gte": start, "$lt": start + timedelta(days=1)}}
+    ]}
+
+def fleet_status_filter(status: str) -> dict:
+    return {"$in": [status, FLEET_STATUS_CODES[status]]}
+
+class SchemaMigrator:
+    """Rewrites legacy documents into the compact layout in the background.
+
+    Walks each collection in _id order in small batches, persisting the last
+    _id in `migrations` so a restart resumes where it stopped. A replace only
+    applies if the document's sync version is unchanged, so a concurrent
+    checkout or return is never overwritten; skipped documents are picked up
+    on the next pass.
+    """
+
+    def __init__(self):
+        self.status = {name: {"migrated": 0, "skipped": 0, "done": False} for name in COMPACT_COLLECTIONS}
+        self._task = None
+
+    async def migrate_collection(self, name: str):
+        state_id = f"compact_schema_v{COMPACT_SCHEMA_VERSION}:{name}"
+        while True:
+            state = await db.migrations.find_one({"_id": state_id}) or {}
+            if state.get("done"):
+                self.status[name]["done"] = True
+                return
+            query = {"schema_version": {"$ne": COMPACT_SCHEMA_VERSION}}
+            if state.get("last_id") is not None:
+                query["_id"] = {"$gt": state["last_id"]}
+            batch = await db[name].find(query).sort("_id", 1).to_list(SCHEMA_MIGRATION_BATCH)
+            if not batch:
+                remaining = await db[name].count_documents({"schema_version": {"$ne": COMPACT_SCHEMA_VERSION}})
+                if remaining:
+                    # Documents skipped due to concurrent writes: start another pass
+                    await db.migrations.update_one({"_id": state_id}, {"$unset": {"last_id": ""}}, upsert=True)
+                    await asyncio.sleep(SCHEMA_MIGRATION_PAUSE_MS / 1000)
+                    continue
+                await db.migrations.update_one({"_id": state_id}, {"$set": {"done": True, "finished_at": now_iso()}}, upsert=True)
+                self.status[name]["done"] = True
+                return
+            ops = [
+                ReplaceOne({"_id": doc["_id"], "version": doc.get("version")}, encode_document(name, decode_document(name, doc)))
+                for doc in batch
+            ]
+            result = await db[name].bulk_write(ops, ordered=False)
+            self.status[name]["migrated"] += result.modified_count
+            self.status[name]["skipped"] += len(ops) - result.matched_count
+            await db.migrations.update_one({"_id": state_id}, {"$set": {"last_id": batch[-1]["_id"]}}, upsert=True)
+            await asyncio.sleep(SCHEMA_MIGRATION_PAUSE_MS / 1000)
+
+    async def _run(self):
+        for name in COMPACT_COLLECTIONS:
+            try:
+                await self.migrate_collection(name)
+            except Exception as e:
+                logger.error(f"Migração de {name} interrompida: {e}")
+        logger.info(f"Migração de esquema: {self.status}")
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+schema_migrator = SchemaMigrator()
+
+# ─── Write Coalescing ─────────────────────────────────────────────────
+
+def configured_write_concern() -> Optional[WriteConcern]:
+    """WriteConcern from WRITE_CONCERN_W/WRITE_CONCERN_J, or None when neither is set."""
+    options = {}
+    if WRITE_CONCERN_W:
+        options["w"] = int(WRITE_CONCERN_W) if WRITE_CONCERN_W.isdigit() else WRITE_CONCERN_W
+    if WRITE_CONCERN_J:
+        options["j"] = WRITE_CONCERN_J.lower() == 'true'
+    return WriteConcern(**options) if options else None
+
+write_concern = configured_write_concern()
+
+def write_collection(name: str):
+    if write_concern is None:
+        return db[name]
+    return db[name].with_options(write_concern=write_concern)
+
+class InsertCoalescer:
+    """Group commit for the check-in hot path.
+
+    Documents queue per collection and are flushed with one insert_many when
+    `max_batch` is reached or `max_delay_ms` elapses; each caller awaits the
+    outcome of its own document.
+    """
+
+    def __init__(self, max_batch: int, max_delay_ms: float):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.stats = {"batches": 0, "documents": 0, "errors": 0}
+        self._pending = {}
+        self._timers = {}
+        self._inflight = set()
+
+    async def insert(self, collection: str, doc: dict):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(collection, [])
+        pending.append((doc, future))
+        if len(pending) >= self.max_batch:
+            self._flush(collection)
+        elif collection not in self._timers:
+            self._timers[collection] = loop.call_later(self.max_delay, self._flush, collection)
+        await future
+
+    def _flush(self, collection: str):
+        timer = self._timers.pop(collection, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(collection, [])
+        if batch:
+            task = asyncio.ensure_future(self._write(collection, batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _write(self, collection: str, batch: list):
+        docs = [doc for doc, _ in batch]
+        failed = {}
+        try:
+            if collection in SYNC_COLLECTIONS:
+                # The batch's versions stay reserved until insert_many returns
+                async with reserve_versions(len(docs)) as last:
+                    updated_at = now_iso()
+                    for i, doc in enumerate(docs):
+                        doc.update({"updated_at": updated_at, "version": last - len(docs) + 1 + i})
+                    await write_collection(collection).insert_many([encode_document(collection, doc) for doc in docs], ordered=False)
+            else:
+                await write_collection(collection).insert_many([encode_document(collection, doc) for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            if e.details.get("writeConcernErrors"):
+                failed = {i: e for i in range(len(batch))}
+            for err in e.details.get("writeErrors", []):
+                failed[err["index"]] = OperationFailure(err.get("errmsg", "insert failed"), err.get("code"))
+        except Exception as e:
+            failed = {i: e for i in range(len(batch))}
+        self.stats["batches"] += 1
+        self.stats["documents"] += len(batch)
+        self.stats["errors"] += len(failed)
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i in failed:
+                future.set_exception(failed[i])
+            else:
+                future.set_result(None)
+
+    async def drain(self):
+        for collection in list(self._pending):
+            self._flush(collection)
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+insert_coalescer = InsertCoalescer(WRITE_COALESCING_MAX_BATCH, WRITE_COALESCING_MAX_DELAY_MS) if WRITE_COALESCING else None
+
+async def insert_document(collection: str, doc: dict):
+    """Insert a document into a synced collection, stamping its sync version."""
+    if insert_coalescer:
+        await insert_coalescer.insert(collection, doc)
+        return
+    async with sync_stamp() as stamp:
+        doc.update(stamp)
+        await write_collection(collection).insert_one(encode_document(collection, doc))
+
+# ─── Visitor Suggest Index ────────────────────────────────────────────
+
+def normalize_text(value: str) -> str:
+    value = unicodedata.normalize("NFKD", value or "")
+    return "".join(c for c in value if not unicodedata.combining(c)).lower().strip()
+
+def normalize_code(value: str) -> str:
+    """Documents and plates compare without punctuation: 'ABC-1234' == 'abc1234'."""
+    return re.sub(r"[^0-9a-z]", "", normalize_text(value))
+
+class VisitorSuggestIndex:
+    """Sorted-array prefix index over distinct returning visitors.
+
+    One profile per normalized document, holding the most recent name, company
+    and plate. `keys` is a sorted list of (prefix_key, document_key) pairs, so a
+    lookup is a bisect plus a short forward scan.
+    """
+
+    MAX_SCAN = 200
+
+    def __init__(self):
+        self.profiles = {}
+        self.keys = []
+        self._profile_keys = {}
+
+    def _index_keys(self, profile: dict) -> set:
+        keys = set()
+        name = normalize_text(profile["name"])
+        if name:
+            keys.add(name)
+            keys.update(token for token in name.split() if len(token) > 1)
+        company = normalize_text(profile["company"])
+        if company:
+            keys.add(company)
+        for code in (profile["document_key"], normalize_code(profile["vehicle_plate"])):
+            if code:
+                keys.add(code)
+        return keys
+
+    def add(self, visitor: dict):
+        doc_key = normalize_code(visitor.get("document", ""))
+        if not doc_key:
+            return
+        current = self.profiles.get(doc_key)
+        if current and current["last_visit"] > (visitor.get("entry_time") or ""):
+            return
+        profile = {
+            "document_key": doc_key,
+            "name": visitor.get("name", ""),
+            "document": visitor.get("document", ""),
+            "company": visitor.get("company", ""),
+            "vehicle_plate": visitor.get("vehicle_plate", ""),
+            "last_visit": visitor.get("entry_time") or ""
+        }
+        self.profiles[doc_key] = profile
+        old_keys = self._profile_keys.get(doc_key, set())
+        new_keys = self._index_keys(profile)
+        for key in old_keys - new_keys:
+            i = bisect.bisect_left(self.keys, (key, doc_key))
+            if i < len(self.keys) and self.keys[i] == (key, doc_key):
+                del self.keys[i]
+        for key in new_keys - old_keys:
+            bisect.insort(self.keys, (key, doc_key))
+        self._profile_keys[doc_key] = new_keys
+
+    def suggest(self, query: str, limit: int = 10) -> list:
+        text, code = normalize_text(query), normalize_code(query)
+        found = {}
+        for prefix in {text, code}:
+            if not prefix:
+                continue
+            i = bisect.bisect_left(self.keys, (prefix, ""))
+            end = min(len(self.keys), i + self.MAX_SCAN)
+            while i < end and self.keys[i][0].startswith(prefix):
+                doc_key = self.keys[i][1]
+                found[doc_key] = self.profiles[doc_key]
+                i += 1
+        ranked = sorted(found.values(), key=lambda p: p["last_visit"], reverse=True)[:limit]
+        return [{k: v for k, v in p.items() if k != "document_key"} for p in ranked]
+
+visitor_suggest_indexes = {}
+
+def suggest_index(site_id: str) -> VisitorSuggestIndex:
+    index = visitor_suggest_indexes.get(site_id)
+    if index is None:
+        index = visitor_suggest_indexes[site_id] = VisitorSuggestIndex()
+    return index
+
+async def build_suggest_indexes():
+    fields = {"_id": 0, "site_id": 1, "name": 1, "document": 1, "company": 1, "vehicle_plate": 1, "entry_time": 1, "date_micros": 1}
+    async for visitor in db.visitors.find({}, fields):
+        suggest_index(visitor.get("site_id", DEFAULT_SITE_ID)).add(decode_document("visitors", visitor))
+    total = sum(len(index.profiles) for index in visitor_suggest_indexes.values())
+    logger.info(f"Índice de sugestões carregado: {total} visitantes em {len(visitor_suggest_indexes)} unidades")
+
+# ─── Visitor Profiles ─────────────────────────────────────────────────
+
+def parse_iso(value: Optional[str]) -> Optional[datetime]:
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def dwell_seconds(entry_time: Optional[str], exit_time: Optional[str]) -> Optional[float]:
+    entry, exit_ = parse_iso(entry_time), parse_iso(exit_time)
+    if not entry or not exit_ or exit_ < entry:
+        return None
+    return (exit_ - entry).total_seconds()
+
+def profile_entry_update(visitor: dict) -> dict:
+    """Incremental update applied to visitor_profiles for one new visit."""
+    update = {
+        "$set": {"document": visitor["document"], "name": visitor["name"]},
+        "$inc": {"visit_count": 1},
+        "$min": {"first_visit": visitor["entry_time"]},
+        "$max": {"last_visit": visitor["entry_time"]}
+    }
+    add_to_set = {}
+    if visitor.get("company"):
+        add_to_set["companies"] = visitor["company"]
+    if visitor.get("vehicle_plate"):
+        add_to_set["plates"] = visitor["vehicle_plate"]
+    if add_to_set:
+        update["$addToSet"] = add_to_set
+    return update
+
+async def rebuild_visitor_profiles() -> int:
+    profiles = {}
+    fields = {"_id": 0, "site_id": 1, "name": 1, "document": 1, "company": 1, "vehicle_plate": 1, "entry_time": 1, "exit_time": 1, "date_micros": 1}
+    async for v in db.visitors.find({}, fields).sort("entry_time", 1):
+        v = decode_document("visitors", v)
+        key = normalize_code(v.get("document", ""))
+        if not key or not v.get("entry_time"):
+            continue
+        site_id = v.get("site_id", DEFAULT_SITE_ID)
+        p = profiles.setdefault((site_id, key), {
+            "site_id": site_id, "document_key": key, "visit_count": 0, "first_visit": v["entry_time"], "last_visit": v["entry_time"],
+            "total_dwell_seconds": 0.0, "completed_visits": 0, "companies": [], "plates": []
+        })
+        # Legacy string and native-date entry_times sort apart, so compare explicitly
+        p["first_visit"] = min(p["first_visit"], v["entry_time"])
+        if v["entry_time"] >= p["last_visit"]:
+            p.update({"document": v["document"], "name": v.get("name", ""), "last_visit": v["entry_time"]})
+        p["visit_count"] += 1
+        dwell = dwell_seconds(v["entry_time"], v.get("exit_time"))
+        if dwell is not None:
+            p["total_dwell_seconds"] += dwell
+            p["completed_visits"] += 1
+        for field, target in (("company", "companies"), ("vehicle_plate", "plates")):
+            if v.get(field) and v[field] not in p[target]:
+                p[target].append(v[field])
+    ops = [ReplaceOne({"site_id": site_id, "document_key": key}, p, upsert=True) for (site_id, key), p in profiles.items()]
+    for i in range(0, len(ops), 1000):
+        await db.visitor_profiles.bulk_write(ops[i:i + 1000], ordered=False)
+    keys_by_site = {}
+    for site_id, key in profiles:
+        keys_by_site.setdefault(site_id, []).append(key)
+    for site_id, keys in keys_by_site.items():
+        await db.visitor_profiles.delete_many({"site_id": site_id, "document_key": {"$nin": keys}})
+    await db.visitor_profiles.delete_many({"site_id": {"$nin": list(keys_by_site)}})
+    logger.info(f"Perfis de visitantes reconstruídos: {len(profiles)}")
+    return len(profiles)
+
+# ─── Recurring Schedules ──────────────────────────────────────────────
+
+RECURRENCE_FREQUENCIES = ("daily", "weekly", "custom")
+DEFAULT_SERIES_WINDOW_DAYS = 30
+MAX_SERIES_WINDOW_DAYS = 366
+
+def parse_day(value: str, field: str) -> str:
+    """Validate a YYYY-MM-DD value from a request; returns it normalized."""
+    try:
+        return date_cls.fromisoformat(value).isoformat()
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Data inválida em {field} (use AAAA-MM-DD)")
+
+def occurrence_id(series_id: str, day: str) -> str:
+    return f"{series_id}:{day}"
+
+def parse_occurrence_id(schedule_id: str):
+    """Split '<series_id>:<YYYY-MM-DD>'; returns (None, None) for plain schedule ids."""
+    if ":" not in schedule_id:
+        return None, None
+    series_id, day = schedule_id.rsplit(":", 1)
+    return series_id, day
+
+def series_dates(series: dict, start: date_cls, end: date_cls) -> list:
+    """Occurrence days in start..end. Days are generated as offsets from
+    `start` that never pass `last`, so windows ending at date.max are safe."""
+    rule = series["recurrence"]
+    first = date_cls.fromisoformat(series["visit_date"])
+    last = min(end, date_cls.fromisoformat(rule["until"])) if rule.get("until") else end
+    start = max(start, first)
+    if start > last:
+        return []
+    interval = max(1, rule.get("interval", 1))
+    if rule["frequency"] == "custom":
+        return sorted(d for d in rule.get("dates", []) if start.isoformat() <= d <= last.isoformat())
+    span = (last - start).days
+    if rule["frequency"] == "daily":
+        offset = (-(start - first).days) % interval
+        return [(start + timedelta(days=n)).isoformat() for n in range(offset, span + 1, interval)]
+    # Weekly: per weekday, the first matching day in an active week, then whole `interval`-week steps
+    first_week = first - timedelta(days=first.weekday())
+    offsets = []
+    for weekday in set(rule.get("weekdays") or [first.weekday()]):
+        offset = (weekday - start.weekday()) % 7
+        week = ((start - first_week).days + offset) // 7
+        offsets.extend(range(offset + (-week) % interval * 7, span + 1, interval * 7))
+    return [(start + timedelta(days=n)).isoformat() for n in sorted(offsets)]
+
+class SeriesExpansionCache:
+    """Expanded occurrences per (site, start, end) window; a series or
+    override write bumps that site's generation and drops its windows."""
+
+    MAX_WINDOWS = 64
+
+    def __init__(self):
+        self.generations = {}
+        self.windows = OrderedDict()
+
+    def invalidate(self, site_id: str):
+        self.generations[site_id] = self.generations.get(site_id, 0) + 1
+        for key in [key for key in self.windows if key[0] == site_id]:
+            del self.windows[key]
+
+    async def occurrences(self, site_id: str, start: str, end: str) -> list:
+        key = (site_id, start, end)
+        if key in self.windows:
+            self.windows.move_to_end(key)
+            return self.windows[key]
+        generation = self.generations.get(site_id, 0)
+        result = await expand_series_window(site_id, start, end)
+        if generation == self.generations.get(site_id, 0):
+            self.windows[key] = result
+            if len(self.windows) > self.MAX_WINDOWS:
+                self.windows.popitem(last=False)
+        return result
+
+series_cache = SeriesExpansionCache()
+
+async def expand_series_window(site_id: str, start: str, end: str) -> list:
+    query = {"site_id": site_id, "visit_date": {"$lte": end}, "$or": [{"recurrence.until": None}, {"recurrence.until": {"$gte": start}}]}
+    series_list = await db.schedule_series.find(query, {"_id": 0}).to_list(1000)
+    if not series_list:
+        return []
+    overrides = await db.schedule_overrides.find(
+        {"series_id": {"$in": [s["id"] for s in series_list]}, "date": {"$gte": start, "$lte": end}}, {"_id": 0}
+    ).to_list(10000)
+    override_by_day = {(o["series_id"], o["date"]): o for o in overrides}
+    window = date_cls.fromisoformat(start), date_cls.fromisoformat(end)
+    occurrences = []
+    for series in series_list:
+        try:
+            days = series_dates(series, *window)
+        except (KeyError, TypeError, ValueError) as e:
+            # A malformed series stored before validation must not take the whole site down
+            logger.warning(f"Série {series['id']} ignorada: {e}")
+            continue
+        for day in days:
+            override = override_by_day.get((series["id"], day), {})
+            status = override.get("status", "pending")
+            if status == "cancelled":
+                continue
+            occurrences.append({
+                "id": occurrence_id(series["id"], day),
+                "series_id": series["id"],
+                "site_id": site_id,
+                "visitor_name": series["visitor_name"],
+                "company": series["company"],
+                "visit_date": day,
+                "visit_time": series["visit_time"],
+                "notes": series["notes"],
+                "status": status,
+                "completed_at": override.get("completed_at"),
+                "recurrence": series["recurrence"],
+                "created_at": series["created_at"]
+            })
+    return occurrences
+
+async def set_occurrence_status(site_id: str, schedule_id: str, status: str) -> bool:
+    """Record a completed/cancelled override; False unless the day is an actual occurrence of the series."""
+    series_id, day = parse_occurrence_id(schedule_id)
+    day = parse_day(day, "id")
+    series = await db.schedule_series.find_one({"site_id": site_id, "id": series_id}, {"_id": 0})
+    if not series:
+        return False
+    try:
+        if day not in series_dates(series, *[date_cls.fromisoformat(day)] * 2):
+            return False
+    except (KeyError, TypeError, ValueError):
+        return False
+    async with sync_stamp() as stamp:
+        await db.schedule_overrides.update_one(
+            {"series_id": series_id, "date": day},
+            {"$set": {"id": schedule_id, "series_id": series_id, "site_id": site_id, "date": day, "status": status,
+                      "completed_at": now_iso() if status == "completed" else None, **stamp}},
+            upsert=True
+        )
+    series_cache.invalidate(site_id)
+    return True
+
+# ─── Visit Scheduler ──────────────────────────────────────────────────
+
+def local_today() -> str:
+    return datetime.now(GATE_TIMEZONE).strftime("%Y-%m-%d")
+
+def schedule_due_at(schedule: dict) -> Optional[datetime]:
+    try:
+        naive = datetime.strptime(f"{schedule['visit_date']} {schedule['visit_time']}", "%Y-%m-%d %H:%M")
+    except (KeyError, TypeError, ValueError):
+        return None
+    return naive.replace(tzinfo=GATE_TIMEZONE)
+
+class VisitScheduler:
+    """In-process timer queue of pending visits.
+
+    `timeline` is a sorted list of (due_at, id) answering "arriving in the next
+    N minutes" with two bisects; `reminders` is a heap of (remind_at, id)
+    drained by a single sleeper task that wakes only when the next reminder is
+    due. Stale heap entries are skipped lazily.
+    """
+
+    MAX_EVENTS = 200
+
+    def __init__(self):
+        self.entries = {}
+        self.timeline = []
+        self.reminders = []
+        self.events = deque(maxlen=self.MAX_EVENTS)
+        self.event_seq = 0
+        self.subscribers = {}  # queue -> site_id
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.series_day = None  # last local day whose recurring occurrences are queued
+
+    def add(self, schedule: dict):
+        self.remove(schedule["id"])
+        due_at = schedule_due_at(schedule)
+        if schedule.get("status") != "pending" or not due_at or due_at < datetime.now(GATE_TIMEZONE):
+            return
+        entry = {
+            "id": schedule["id"],
+            "site_id": schedule.get("site_id", DEFAULT_SITE_ID),
+            "visitor_name": schedule.get("visitor_name", ""),
+            "company": schedule.get("company", ""),
+            "visit_date": schedule["visit_date"],
+            "visit_time": schedule["visit_time"],
+            "notes": schedule.get("notes", ""),
+            "due_at": due_at,
+            "remind_at": due_at - timedelta(minutes=REMINDER_LEAD_MINUTES)
+        }
+        self.entries[entry["id"]] = entry
+        bisect.insort(self.timeline, (due_at, entry["id"]))
+        heapq.heappush(self.reminders, (entry["remind_at"], entry["id"]))
+        self._wakeup.set()
+
+    def remove(self, schedule_id: str):
+        entry = self.entries.pop(schedule_id, None)
+        if entry:
+            i = bisect.bisect_left(self.timeline, (entry["due_at"], schedule_id))
+            if i < len(self.timeline) and self.timeline[i][1] == schedule_id:
+                del self.timeline[i]
+
+    @staticmethod
+    def _public(entry: dict, now: datetime) -> dict:
+        public = {k: v for k, v in entry.items() if k not in ("due_at", "remind_at")}
+        public["due_at"] = entry["due_at"].isoformat()
+        public["minutes_until"] = max(0, int((entry["due_at"] - now).total_seconds() // 60))
+        return public
+
+    def upcoming(self, site_id: str, minutes: int) -> list:
+        now = datetime.now(GATE_TIMEZONE)
+        start = bisect.bisect_left(self.timeline, (now, ""))
+        end = bisect.bisect_right(self.timeline, (now + timedelta(minutes=minutes), "\uffff"))
+        entries = (self.entries[sid] for _, sid in self.timeline[start:end])
+        return [self._public(entry, now) for entry in entries if entry["site_id"] == site_id]
+
+    def _emit(self, entry: dict, now: datetime):
+        self.event_seq += 1
+        event = {"seq": self.event_seq, "type": "visit_reminder", "schedule": self._public(entry, now)}
+        self.events.append(event)
+        for queue, site_id in list(self.subscribers.items()):
+            if site_id != entry["site_id"]:
+                continue
+            if queue.full():
+                self.subscribers.pop(queue, None)
+            else:
+                queue.put_nowait(event)
+        logger.info(f"Lembrete: {entry['visitor_name']} às {entry['visit_time']}")
+
+    async def load_series_day(self, day: str):
+        for site_id in await known_sites():
+            for occurrence in await series_cache.occurrences(site_id, day, day):
+                self.add(occurrence)
+        self.series_day = day
+
+    @staticmethod
+    def series_horizon(now: datetime) -> date_cls:
+        """Last local day whose occurrences must be queued: tomorrow as soon as
+        the reminder for a visit at 00:00 could fall due."""
+        return (now + timedelta(minutes=REMINDER_LEAD_MINUTES)).date()
+
+    async def load_series_through(self, last_day: date_cls):
+        day = datetime.now(GATE_TIMEZONE).date()
+        if self.series_day:
+            day = max(day, date_cls.fromisoformat(self.series_day) + timedelta(days=1))
+        while day <= last_day:
+            await self.load_series_day(day.isoformat())
+            day += timedelta(days=1)
+
+    async def _run(self):
+        while True:
+            horizon = self.series_horizon(datetime.now(GATE_TIMEZONE))
+            if self.series_day != horizon.isoformat():
+                try:
+                    await self.load_series_through(horizon)
+                except Exception as e:
+                    logger.error(f"Falha ao carregar agendamentos recorrentes: {e}")
+            now = datetime.now(GATE_TIMEZONE)
+            while self.reminders and self.reminders[0][0] <= now:
+                remind_at, sid = heapq.heappop(self.reminders)
+                entry = self.entries.get(sid)
+                if entry and entry["remind_at"] == remind_at:
+                    self._emit(entry, now)
+            while self.timeline and self.timeline[0][0] < now:
+                _, sid = self.timeline.pop(0)
+                self.entries.pop(sid, None)
+            # Wake for the next reminder or when the horizon reaches a new day, whichever is first
+            next_day = datetime.combine(horizon + timedelta(days=1), datetime.min.time(), tzinfo=GATE_TIMEZONE)
+            delay = next_day.timestamp() - REMINDER_LEAD_MINUTES * 60 - now.timestamp()
+            if self.reminders:
+                delay = min(delay, self.reminders[0][0].timestamp() - now.timestamp())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=min(max(delay, 0), 3600))
+            except asyncio.TimeoutError:
+                pass
+
+    async def load(self):
+        query = {"visit_date": {"$gte": local_today()}, "status": "pending"}
+        async for schedule in db.schedules.find(query, {"_id": 0}):
+            self.add(schedule)
+        await self.load_series_through(self.series_horizon(datetime.now(GATE_TIMEZONE)))
+        logger.info(f"Agenda carregada: {len(self.entries)} visitas pendentes")
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+visit_scheduler = VisitScheduler()
+
+# ─── Admission Control ────────────────────────────────────────────────
+
+class AdmissionLane:
+    """Bounded concurrency plus a bounded wait queue for one class of heavy
+    requests. Work beyond the queue, or that waits longer than `max_wait`,
+    is shed with 503 and a Retry-After estimated from recent service times."""
+
+    WAIT_SAMPLES = 256
+
+    def __init__(self, name: str, concurrency: int, queue_limit: int, max_wait: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.max_wait = max_wait
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.waits = deque(maxlen=self.WAIT_SAMPLES)
+        self.service_seconds = 1.0
+        self.stats = {"admitted": 0, "shed_queue_full": 0, "shed_timeout": 0, "peak_waiting": 0}
+
+    def retry_after(self) -> int:
+        backlog = (self.waiting + 1) / max(1, self.concurrency)
+        return max(1, int(backlog * self.service_seconds) + 1)
+
+    def _shed(self, reason: str):
+        self.stats[reason] += 1
+        raise HTTPException(status_code=503, detail="Servidor ocupado, tente novamente", headers={"Retry-After": str(self.retry_after())})
+
+    async def acquire(self):
+        if self.active + self.waiting >= self.concurrency + self.queue_limit:
+            self._shed("shed_queue_full")
+        self.waiting += 1
+        self.stats["peak_waiting"] = max(self.stats["peak_waiting"], self.waiting)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            self._shed("shed_timeout")
+        finally:
+            self.waiting -= 1
+        self.waits.append(time.monotonic() - started)
+        self.active += 1
+        self.stats["admitted"] += 1
+
+    def release(self, service_seconds: float):
+        self.active -= 1
+        self.service_seconds = 0.8 * self.service_seconds + 0.2 * service_seconds
+        self.semaphore.release()
+
+    def snapshot(self) -> dict:
+        waits = sorted(self.waits)
+
+        def pick(pct):
+            return round(waits[min(len(waits) - 1, int(len(waits) * pct / 100))] * 1000, 1) if waits else 0.0
+
+        return {
+            **self.stats,
+            "active": self.active,
+            "waiting": self.waiting,
+            "concurrency": self.concurrency,
+            "queue_limit": self.queue_limit,
+            "wait_ms_p50": pick(50),
+            "wait_ms_p99": pick(99),
+            "wait_ms_max": round(waits[-1] * 1000, 1) if waits else 0.0,
+            "service_ms_avg": round(self.service_seconds * 1000, 1)
+        }
+
+admission_lanes = {
+    "export": AdmissionLane("export", LANE_EXPORT_CONCURRENCY, LANE_EXPORT_QUEUE, LANE_MAX_WAIT_SECONDS),
+    "bulk": AdmissionLane("bulk", LANE_BULK_CONCURRENCY, LANE_BULK_QUEUE, LANE_MAX_WAIT_SECONDS),
+    "report": AdmissionLane("report", LANE_REPORT_CONCURRENCY, LANE_REPORT_QUEUE, LANE_MAX_WAIT_SECONDS),
+    "search": AdmissionLane("search", LANE_SEARCH_CONCURRENCY, LANE_SEARCH_QUEUE, LANE_MAX_WAIT_SECONDS),
+}
+interactive_stats = {"in_flight": 0, "served": 0}
+
+def classify_request(request: Request) -> Optional[str]:
+    """Lane for a heavy request, or None for interactive traffic that is never queued."""
+    path = request.url.path
+    if path.startswith("/api/reports/export/bulk/"):
+        # Warehouse dumps hold their slot for the whole stream; keep them off the daily exports
+        return "bulk"
+    if path.startswith("/api/reports/export/"):
+        return "export"
+    if path == "/api/reports/observation":
+        # The porter's end-of-shift note is an interactive write
+        return None
+    if path.startswith("/api/reports/") or path == "/api/visitors/profiles/rebuild":
+        return "report"
+    if request.method == "GET" and path in ("/api/visitors", "/api/fleet") and request.query_params.get("search"):
+        return "search"
+    return None
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    lane = admission_lanes.get(classify_request(request))
+    if lane is None:
+        interactive_stats["in_flight"] += 1
+        try:
+            return await call_next(request)
+        finally:
+            interactive_stats["in_flight"] -= 1
+            interactive_stats["served"] += 1
+    try:
+        # Anonymous or forged requests are rejected here, before they can occupy a queue slot
+        await get_current_user(request)
+        await lane.acquire()
+    except HTTPException as e:
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+    started = time.monotonic()
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            lane.release(time.monotonic() - started)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        release()
+        raise
+    body = response.body_iterator
+
+    async def release_after_body():
+        # Streamed bodies (bulk exports) hold their slot until the last byte
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            release()
+
+    response.body_iterator = release_after_body()
+    # A body that is never iterated (client gone before the first chunk) still frees the slot
+    weakref.finalize(response.body_iterator, release)
+    return response
+
+# ─── Loop Watchdog ────────────────────────────────────────────────────
+
+class LoopWatchdog:
+    """Measures event-loop lag and catches whatever is blocking it.
+
+    A coroutine on the loop sleeps for a fixed interval and records how late
+    it wakes up. A daemon thread watches that heartbeat; once it is older
+    than the threshold, the thread samples the loop thread's stack, so the
+    blocking call is caught while it is still running, and finds the route
+    from the first frame holding a `request`.
+    """
+
+    LAG_SAMPLES = 600
+    MAX_INCIDENTS = 20
+    STACK_DEPTH = 15
+
+    def __init__(self, interval_ms: float, threshold_ms: float):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.lags = deque(maxlen=self.LAG_SAMPLES)
+        self.incidents = deque(maxlen=self.MAX_INCIDENTS)
+        self.stalls = 0
+        self.last_beat = time.monotonic()
+        self._loop_thread = None
+        self._task = None
+        self._stop = threading.Event()
+
+    async def _beat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_beat = time.monotonic()
+            self.lags.append(max(0.0, self.last_beat - started - self.interval))
+
+    @staticmethod
+    def _route(frame) -> Optional[str]:
+        while frame is not None:
+            request = frame.f_locals.get("request")
+            if isinstance(request, Request):
+                return f"{request.method} {request.url.path}"
+            frame = frame.f_back
+        return None
+
+    def _sample(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = traceback.format_stack(frame)[-self.STACK_DEPTH:]
+        incident = {
+            "at": now_iso(),
+            "stalled_ms": round(stalled * 1000, 1),
+            "route": self._route(frame),
+            "stack": [line.rstrip() for line in stack]
+        }
+        self.stalls += 1
+        self.incidents.append(incident)
+        culprit = stack[-1].strip().splitlines()[0] if stack else "?"
+        logger.warning(f"Event loop bloqueado há {incident['stalled_ms']} ms em {incident['route'] or 'tarefa de fundo'}: {culprit}")
+
+    def _watch(self):
+        sampled_beat = None
+        while not self._stop.wait(self.interval / 2):
+            beat = self.last_beat
+            stalled = time.monotonic() - beat
+            if stalled > self.threshold and beat != sampled_beat:
+                sampled_beat = beat
+                self._sample(stalled)
+
+    def lag_snapshot(self) -> dict:
+        lags = sorted(self.lags)
+
+        def pick(pct):
+            return round(lags[min(len(lags) - 1, int(len(lags) * pct / 100))] * 1000, 1) if lags else 0.0
+
+        return {
+            "p50_ms": pick(50),
+            "p95_ms": pick(95),
+            "p99_ms": pick(99),
+            "max_ms": round(lags[-1] * 1000, 1) if lags else 0.0,
+            "current_ms": round(max(0.0, time.monotonic() - self.last_beat - self.interval) * 1000, 1),
+            "samples": len(lags),
+            "stalls": self.stalls
+        }
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.ensure_future(self._beat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+loop_watchdog = LoopWatchdog(LOOP_LAG_INTERVAL_MS, LOOP_LAG_THRESHOLD_MS)
 
 # ─── Startup ──────────────────────────────────────────────────────────
 
 @app.on_event("startup")
 async def startup():
+    loop_watchdog.start()
     admin = await db.users.find_one({"username": "admin"}, {"_id": 0})
     if not admin:
         await db.users.insert_one({
             "id": str(uuid.uuid4()),
             "username": "admin",
-            "password": hash_password("admin123"),
+            "password": await asyncio.to_thread(hash_password, "admin123"),
             "name": "Administrador",
             "role": "admin",
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "site_id": DEFAULT_SITE_ID,
+            "created_at": now_iso()
         })
         logger.info("Admin padrão criado: admin / admin123")
-    # Create indexes
-    await db.visitors.create_index("entry_time")
-    await db.schedules.create_index("visit_date")
-    await db.fleet_trips.create_index("created_at")
+    await backfill_site_ids()
+    await drop_superseded_indexes()
+    # Create indexes: every gate query is prefixed by site_id
+    await db.visitors.create_index([("site_id", 1), ("entry_time", 1)])
+    await db.visitors.create_index([("site_id", 1), ("exit_time", 1)])
+    await db.schedules.create_index([("site_id", 1), ("visit_date", 1), ("status", 1), ("visit_time", 1)])
+    await db.schedule_series.create_index([("site_id", 1), ("visit_date", 1)])
+    await db.schedule_overrides.create_index([("series_id", 1), ("date", 1)], unique=True)
+    await db.fleet_trips.create_index([("site_id", 1), ("created_at", 1)])
+    await db.fleet_trips.create_index([("site_id", 1), ("status", 1)])
+    await db.visitors.create_index([("site_id", 1), ("id", 1)])
+    await db.fleet_trips.create_index([("site_id", 1), ("id", 1)])
+    for name in BULK_EXPORT_COLLECTIONS:
+        await db[name].create_index([("site_id", 1), ("_id", 1)])
+    await db.schedules.create_index([("site_id", 1), ("id", 1)])
+    await db.schedule_series.create_index([("site_id", 1), ("id", 1)])
+    await db.users.create_index("site_id")
+    await db["attachments.files"].create_index([("metadata.site_id", 1), ("metadata.owner_id", 1)])
+    await backfill_sync_versions()
+    for name in SYNC_COLLECTIONS:
+        await db[name].create_index([("site_id", 1), ("version", 1)])
+    await db.sync_tombstones.create_index([("site_id", 1), ("version", 1)])
+    await build_suggest_indexes()
+    await visit_scheduler.load()
+    visit_scheduler.start()
+    await db.report_snapshots.create_index([("site_id", 1), ("date", 1)], unique=True)
+    await db.report_observations.create_index([("site_id", 1), ("date", 1)], unique=True)
+    await db.visitor_profiles.create_index([("site_id", 1), ("document_key", 1)], unique=True)
+    if not await db.visitor_profiles.find_one({}, {"_id": 1}) and await db.visitors.find_one({}, {"_id": 1}):
+        await rebuild_visitor_profiles()
+    report_snapshotter.start()
+    if SCHEMA_MIGRATION:
+        schema_migrator.start()
 
 # ─── Auth Routes ──────────────────────────────────────────────────────
 
 @api_router.post("/auth/login")
-async def login(req: LoginRequest):
+async def login(req: LoginRequest, request: Request):
+    auth_admission.admit(client_ip(request), req.username)
     user = await db.users.find_one({"username": req.username}, {"_id": 0})
-    if not user or not verify_password(req.password, user["password"]):
+    if not user or not await auth_admission.run_hash(verify_password, req.password, user["password"]):
         raise HTTPException(status_code=401, detail="Credenciais inválidas")
-    token = create_token(user["id"], user["username"], user["role"], user["name"])
-    return {"token": token, "user": {"id": user["id"], "username": user["username"], "name": user["name"], "role": user["role"]}}
+    site_id = user.get("site_id", DEFAULT_SITE_ID)
+    token = create_token(user["id"], user["username"], user["role"], user["name"], site_id)
+    return {"token": token, "user": {"id": user["id"], "username": user["username"], "name": user["name"], "role": user["role"], "site_id": site_id}}
 
 @api_router.get("/auth/verify")
 async def verify_token(request: Request):
     user = await get_current_user(request)
-    return {"user": {"id": user["user_id"], "username": user["username"], "name": user["name"], "role": user["role"]}}
+    return {"user": {"id": user["user_id"], "username": user["username"], "name": user["name"], "role": user["role"], "site_id": user["site_id"]}}
+
+@api_router.get("/auth/limits")
+async def get_auth_limits(request: Request):
+    user = await get_current_user(request)
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    return auth_admission.snapshot()
+
+@api_router.get("/admission")
+async def get_admission_lanes(request: Request):
+    user = await get_current_user(request)
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    return {"interactive": dict(interactive_stats), "lanes": {name: lane.snapshot() for name, lane in admission_lanes.items()}}
 
 # ─── User Management (Admin only) ────────────────────────────────────
 
@@ -173,16 +1532,18 @@ async def create_user(req: UserCreate, request: Request):
     existing = await db.users.find_one({"username": req.username}, {"_id": 0})
     if existing:
         raise HTTPException(status_code=400, detail="Usuário já existe")
+    auth_admission.admit(client_ip(request))
     new_user = {
         "id": str(uuid.uuid4()),
         "username": req.username,
-        "password": hash_password(req.password),
+        "password": await auth_admission.run_hash(hash_password, req.password),
         "name": req.name,
         "role": req.role,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "site_id": req.site_id or user["site_id"],
+        "created_at": now_iso()
     }
     await db.users.insert_one(new_user)
-    return {"id": new_user["id"], "username": new_user["username"], "name": new_user["name"], "role": new_user["role"]}
+    return {"id": new_user["id"], "username": new_user["username"], "name": new_user["name"], "role": new_user["role"], "site_id": new_user["site_id"]}
 
 @api_router.put("/users/{user_id}")
 async def update_user(user_id: str, req: UserUpdate, request: Request):
@@ -193,11 +1554,14 @@ async def update_user(user_id: str, req: UserUpdate, request: Request):
     if req.username:
         update_data["username"] = req.username
     if req.password:
-        update_data["password"] = hash_password(req.password)
+        auth_admission.admit(client_ip(request))
+        update_data["password"] = await auth_admission.run_hash(hash_password, req.password)
     if req.name:
         update_data["name"] = req.name
     if req.role:
         update_data["role"] = req.role
+    if req.site_id:
+        update_data["site_id"] = req.site_id
     if not update_data:
         raise HTTPException(status_code=400, detail="Nenhum campo para atualizar")
     result = await db.users.update_one({"id": user_id}, {"$set": update_data})
@@ -221,105 +1585,275 @@ async def delete_user(user_id: str, request: Request):
 
 @api_router.post("/visitors")
 async def create_visitor(req: VisitorCreate, request: Request):
-    await get_current_user(request)
+    user = await get_current_user(request)
+    now = now_iso()
     visitor = {
         "id": str(uuid.uuid4()),
+        "site_id": user["site_id"],
         "name": req.name,
         "document": req.document,
-        "entry_time": req.entry_time or datetime.now(timezone.utc).isoformat(),
+        "entry_time": req.entry_time or now,
         "exit_time": None,
         "vehicle_plate": req.vehicle_plate or "",
         "company": req.company or "",
         "observation": req.observation or "",
         "invoice": req.invoice or "",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": now
     }
-    await db.visitors.insert_one(visitor)
+    await insert_document("visitors", visitor)
+    suggest_index(user["site_id"]).add(visitor)
+    document_key = normalize_code(visitor["document"])
+    if document_key:
+        await db.visitor_profiles.update_one({"site_id": user["site_id"], "document_key": document_key}, profile_entry_update(visitor), upsert=True)
+    await report_snapshotter.mark_stale(user["site_id"], visitor["entry_time"][:10])
     return {k: v for k, v in visitor.items() if k != "_id"}
 
 @api_router.get("/visitors")
 async def list_visitors(request: Request, date: Optional[str] = None, active: Optional[bool] = None, search: Optional[str] = None):
-    await get_current_user(request)
-    query = {}
+    user = await get_current_user(request)
+    query = {"site_id": user["site_id"]}
     if active is True:
         query["exit_time"] = None
     if search:
         regex = {"$regex": search, "$options": "i"}
         query["$or"] = [{"name": regex}, {"document": regex}, {"invoice": regex}, {"company": regex}, {"vehicle_plate": regex}]
     elif date:
-        query["entry_time"] = {"$regex": f"^{date}"}
+        query.update(day_filter("entry_time", date))
     visitors = await db.visitors.find(query, {"_id": 0}).sort("entry_time", -1).to_list(1000)
-    return visitors
+    return [decode_document("visitors", v) for v in visitors]
+
+@api_router.get("/visitors/suggest")
+async def suggest_visitors(request: Request, q: str = "", limit: int = 10):
+    user = await get_current_user(request)
+    if len(q.strip()) < 2:
+        return []
+    return suggest_index(user["site_id"]).suggest(q, max(1, min(limit, 25)))
+
+@api_router.get("/visitors/profile/{document}")
+async def get_visitor_profile(document: str, request: Request):
+    user = await get_current_user(request)
+    profile = await db.visitor_profiles.find_one({"site_id": user["site_id"], "document_key": normalize_code(document)}, {"_id": 0})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Perfil não encontrado")
+    completed = profile.get("completed_visits", 0)
+    profile["average_stay_minutes"] = round(profile.get("total_dwell_seconds", 0) / completed / 60, 1) if completed else None
+    return profile
+
+@api_router.post("/visitors/profiles/rebuild")
+async def rebuild_profiles(request: Request):
+    user = await get_current_user(request)
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    count = await rebuild_visitor_profiles()
+    return {"message": "Perfis reconstruídos", "profiles": count}
 
 @api_router.put("/visitors/{visitor_id}/checkout")
 async def checkout_visitor(visitor_id: str, request: Request):
-    await get_current_user(request)
-    exit_time = datetime.now(timezone.utc).isoformat()
-    result = await db.visitors.update_one(
-        {"id": visitor_id, "exit_time": None},
-        {"$set": {"exit_time": exit_time}}
-    )
-    if result.matched_count == 0:
+    user = await get_current_user(request)
+    exit_time = now_iso()
+    async with sync_stamp() as stamp:
+        visitor = await db.visitors.find_one_and_update(
+            {"site_id": user["site_id"], **id_filter(visitor_id), "exit_time": None},
+            encode_update("visitors", {"exit_time": exit_time, **stamp}),
+            projection={"_id": 0, "entry_time": 1, "date_micros": 1, "document": 1}
+        )
+    visitor = decode_document("visitors", visitor)
+    if not visitor:
         raise HTTPException(status_code=404, detail="Visitante não encontrado ou já deu saída")
+    dwell = dwell_seconds(visitor.get("entry_time"), exit_time)
+    if dwell is not None:
+        await db.visitor_profiles.update_one(
+            {"site_id": user["site_id"], "document_key": normalize_code(visitor.get("document", ""))},
+            {"$inc": {"total_dwell_seconds": dwell, "completed_visits": 1}}
+        )
+    await report_snapshotter.mark_stale(user["site_id"], (visitor.get("entry_time") or "")[:10])
     return {"message": "Saída registrada", "exit_time": exit_time}
 
 # ─── Schedules ────────────────────────────────────────────────────────
 
 @api_router.post("/schedules")
 async def create_schedule(req: ScheduleCreate, request: Request):
-    await get_current_user(request)
+    user = await get_current_user(request)
+    if req.recurrence:
+        return await create_schedule_series(user["site_id"], req)
     schedule = {
         "id": str(uuid.uuid4()),
+        "site_id": user["site_id"],
         "visitor_name": req.visitor_name,
         "company": req.company or "",
         "visit_date": req.visit_date,
         "visit_time": req.visit_time,
         "notes": req.notes or "",
         "status": "pending",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": now_iso()
     }
-    await db.schedules.insert_one(schedule)
+    await insert_document("schedules", schedule)
+    visit_scheduler.add(schedule)
+    await report_snapshotter.mark_stale(user["site_id"], schedule["visit_date"])
     return {k: v for k, v in schedule.items() if k != "_id"}
 
+async def create_schedule_series(site_id: str, req: ScheduleCreate) -> dict:
+    rule = req.recurrence
+    if rule.frequency not in RECURRENCE_FREQUENCIES:
+        raise HTTPException(status_code=400, detail="Frequência inválida")
+    if rule.frequency == "custom" and not rule.dates:
+        raise HTTPException(status_code=400, detail="Informe as datas da recorrência")
+    if any(d < 0 or d > 6 for d in rule.weekdays):
+        raise HTTPException(status_code=400, detail="Dia da semana inválido")
+    if rule.interval < 1:
+        raise HTTPException(status_code=400, detail="Intervalo deve ser no mínimo 1")
+    req.visit_date = parse_day(req.visit_date, "visit_date")
+    if rule.until:
+        rule.until = parse_day(rule.until, "recurrence.until")
+    rule.dates = sorted({parse_day(d, "recurrence.dates") for d in rule.dates})
+    series = {
+        "id": str(uuid.uuid4()),
+        "site_id": site_id,
+        "visitor_name": req.visitor_name,
+        "company": req.company or "",
+        "visit_date": req.visit_date,
+        "visit_time": req.visit_time,
+        "notes": req.notes or "",
+        "recurrence": rule.model_dump(),
+        "created_at": now_iso()
+    }
+    await insert_document("schedule_series", series)
+    series_cache.invalidate(site_id)
+    for occurrence in await series_cache.occurrences(site_id, local_today(), visit_scheduler.series_day or local_today()):
+        if occurrence["series_id"] == series["id"]:
+            visit_scheduler.add(occurrence)
+    return {k: v for k, v in series.items() if k != "_id"}
+
 @api_router.get("/schedules")
-async def list_schedules(request: Request, date: Optional[str] = None):
-    await get_current_user(request)
-    query = {}
+async def list_schedules(request: Request, date: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None):
+    """One-off schedules plus recurring occurrences expanded for the window
+    (the given date, start..end, or the next DEFAULT_SERIES_WINDOW_DAYS), at
+    most MAX_SERIES_WINDOW_DAYS long."""
+    user = await get_current_user(request)
+    date, start, end = (parse_day(v, name) if v else None for v, name in ((date, "date"), (start, "start"), (end, "end")))
+    query = {"site_id": user["site_id"]}
     if date:
         query["visit_date"] = date
+        start = end = date
+    elif start or end:
+        query["visit_date"] = {k: v for k, v in (("$gte", start), ("$lte", end)) if v}
+    first = date_cls.fromisoformat(start or local_today())
+    try:
+        last = date_cls.fromisoformat(end) if end else first + timedelta(days=DEFAULT_SERIES_WINDOW_DAYS)
+    except OverflowError:
+        last = date_cls.max
+    if (last - first).days > MAX_SERIES_WINDOW_DAYS:
+        raise HTTPException(status_code=400, detail=f"Período máximo de {MAX_SERIES_WINDOW_DAYS} dias")
     schedules = await db.schedules.find(query, {"_id": 0}).sort("visit_date", 1).to_list(1000)
+    start, end = first.isoformat(), last.isoformat()
+    schedules.extend(await series_cache.occurrences(user["site_id"], start, end))
+    schedules.sort(key=lambda s: (s["visit_date"], s["visit_time"]))
+    return schedules
+
+async def pending_today_schedules(site_id: str, projection: Optional[dict] = None) -> list:
+    today = local_today()
+    projection = {"_id": 0, **(projection or {})}
+    schedules = await db.schedules.find({"site_id": site_id, "visit_date": today, "status": "pending"}, projection).sort("visit_time", 1).to_list(1000)
+    occurrences = [o for o in await series_cache.occurrences(site_id, today, today) if o["status"] == "pending"]
+    if len(projection) > 1:
+        occurrences = [{k: o.get(k) for k in projection if k != "_id"} for o in occurrences]
+    schedules.extend(occurrences)
+    schedules.sort(key=lambda s: s["visit_time"])
     return schedules
 
 @api_router.get("/schedules/today")
 async def get_today_schedules(request: Request):
-    await get_current_user(request)
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    schedules = await db.schedules.find({"visit_date": today, "status": "pending"}, {"_id": 0}).to_list(1000)
-    return schedules
+    user = await get_current_user(request)
+    return await pending_today_schedules(user["site_id"])
+
+@api_router.get("/schedules/upcoming")
+async def get_upcoming_schedules(request: Request, minutes: int = 30):
+    user = await get_current_user(request)
+    return visit_scheduler.upcoming(user["site_id"], max(1, min(minutes, 24 * 60)))
+
+@api_router.get("/schedules/reminders/stream")
+async def stream_schedule_reminders(request: Request, since: int = 0):
+    """Server-sent reminder events; pass ?authorization= since EventSource cannot set headers."""
+    user = await get_current_user(request)
+    queue = asyncio.Queue(maxsize=100)
+    backlog = [e for e in visit_scheduler.events if e["seq"] > since and e["schedule"]["site_id"] == user["site_id"]]
+    visit_scheduler.subscribers[queue] = user["site_id"]
+
+    async def events():
+        try:
+            for event in backlog:
+                yield f"id: {event['seq']}\nevent: reminder\ndata: {json.dumps(event)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                    yield f"id: {event['seq']}\nevent: reminder\ndata: {json.dumps(event)}\n\n"
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            visit_scheduler.subscribers.pop(queue, None)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @api_router.put("/schedules/{schedule_id}/complete")
 async def complete_schedule(schedule_id: str, request: Request):
-    await get_current_user(request)
-    result = await db.schedules.update_one({"id": schedule_id}, {"$set": {"status": "completed"}})
-    if result.matched_count == 0:
+    user = await get_current_user(request)
+    if parse_occurrence_id(schedule_id)[0]:
+        if not await set_occurrence_status(user["site_id"], schedule_id, "completed"):
+            raise HTTPException(status_code=404, detail="Agendamento não encontrado")
+        visit_scheduler.remove(schedule_id)
+        await report_snapshotter.mark_stale(user["site_id"], parse_occurrence_id(schedule_id)[1])
+        return {"message": "Agendamento concluído"}
+    async with sync_stamp() as stamp:
+        schedule = await db.schedules.find_one_and_update(
+            {"site_id": user["site_id"], "id": schedule_id},
+            {"$set": {"status": "completed", "completed_at": now_iso(), **stamp}},
+            projection={"_id": 0, "visit_date": 1}
+        )
+    if not schedule:
         raise HTTPException(status_code=404, detail="Agendamento não encontrado")
+    visit_scheduler.remove(schedule_id)
+    await report_snapshotter.mark_stale(user["site_id"], schedule.get("visit_date"))
     return {"message": "Agendamento concluído"}
 
 @api_router.delete("/schedules/{schedule_id}")
 async def delete_schedule(schedule_id: str, request: Request):
-    await get_current_user(request)
-    result = await db.schedules.delete_one({"id": schedule_id})
+    """Deletes a one-off schedule, cancels a single recurring occurrence
+    ('<series_id>:<date>'), or deletes a whole series by its id."""
+    user = await get_current_user(request)
+    site_id = user["site_id"]
+    if parse_occurrence_id(schedule_id)[0]:
+        if not await set_occurrence_status(site_id, schedule_id, "cancelled"):
+            raise HTTPException(status_code=404, detail="Agendamento não encontrado")
+        visit_scheduler.remove(schedule_id)
+        await report_snapshotter.mark_stale(site_id, parse_occurrence_id(schedule_id)[1])
+        return {"message": "Agendamento deletado"}
+    schedule = await db.schedules.find_one_and_delete({"site_id": site_id, "id": schedule_id}, projection={"_id": 0, "visit_date": 1})
+    if schedule:
+        await record_deletion("schedules", schedule_id, site_id)
+        visit_scheduler.remove(schedule_id)
+        await report_snapshotter.mark_stale(site_id, schedule.get("visit_date"))
+        return {"message": "Agendamento deletado"}
+    result = await db.schedule_series.delete_one({"site_id": site_id, "id": schedule_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Agendamento não encontrado")
+    await record_deletion("schedule_series", schedule_id, site_id)
+    override_query = {"site_id": site_id, "series_id": schedule_id}
+    override_ids = await db.schedule_overrides.distinct("id", override_query)
+    await db.schedule_overrides.delete_many(override_query)
+    await record_deletions("schedule_overrides", override_ids, site_id)
+    series_cache.invalidate(site_id)
+    for sid in [sid for sid in visit_scheduler.entries if sid.startswith(f"{schedule_id}:")]:
+        visit_scheduler.remove(sid)
     return {"message": "Agendamento deletado"}
 
 # ─── Fleet ────────────────────────────────────────────────────────────
 
 @api_router.post("/fleet")
 async def create_fleet_trip(req: FleetTripCreate, request: Request):
-    await get_current_user(request)
+    user = await get_current_user(request)
     trip = {
         "id": str(uuid.uuid4()),
+        "site_id": user["site_id"],
         "driver_name": req.driver_name,
         "vehicle": req.vehicle,
         "departure_km": req.departure_km,
@@ -328,53 +1862,297 @@ async def create_fleet_trip(req: FleetTripCreate, request: Request):
         "arrival_km": None,
         "distance": None,
         "status": "em_viagem",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": now_iso()
     }
-    await db.fleet_trips.insert_one(trip)
+    await insert_document("fleet_trips", trip)
     return {k: v for k, v in trip.items() if k != "_id"}
 
 @api_router.get("/fleet")
 async def list_fleet_trips(request: Request, date: Optional[str] = None, active: Optional[bool] = None, search: Optional[str] = None):
-    await get_current_user(request)
-    query = {}
+    user = await get_current_user(request)
+    query = {"site_id": user["site_id"]}
     if active is True:
-        query["status"] = "em_viagem"
+        query["status"] = fleet_status_filter("em_viagem")
     if search:
         regex = {"$regex": search, "$options": "i"}
         query["$or"] = [{"driver_name": regex}, {"vehicle": regex}, {"invoice": regex}, {"destination": regex}]
     elif date:
-        query["created_at"] = {"$regex": f"^{date}"}
+        query.update(day_filter("created_at", date))
     trips = await db.fleet_trips.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return trips
+    return [decode_document("fleet_trips", t) for t in trips]
 
 @api_router.put("/fleet/{trip_id}/return")
 async def return_fleet_trip(trip_id: str, req: FleetTripReturn, request: Request):
-    await get_current_user(request)
-    trip = await db.fleet_trips.find_one({"id": trip_id}, {"_id": 0})
+    user = await get_current_user(request)
+    trip_filter = {"site_id": user["site_id"], **id_filter(trip_id)}
+    trip = decode_document("fleet_trips", await db.fleet_trips.find_one(trip_filter, {"_id": 0}))
     if not trip:
         raise HTTPException(status_code=404, detail="Viagem não encontrada")
     if trip["status"] != "em_viagem":
         raise HTTPException(status_code=400, detail="Veículo já retornou")
     distance = req.arrival_km - trip["departure_km"]
-    result = await db.fleet_trips.update_one(
-        {"id": trip_id},
-        {"$set": {"arrival_km": req.arrival_km, "distance": distance, "status": "retornado"}}
-    )
+    async with sync_stamp() as stamp:
+        await db.fleet_trips.update_one(
+            trip_filter,
+            encode_update("fleet_trips", {"arrival_km": req.arrival_km, "distance": distance, "status": "retornado", **stamp})
+        )
+    await report_snapshotter.mark_stale(user["site_id"], trip["created_at"][:10])
     return {"message": "Retorno registrado", "distance": distance}
 
+# ─── Attachments ──────────────────────────────────────────────────────
+#
+# Photos, ID scans and invoices live in the `attachments` GridFS bucket and
+# point at their visitor or trip through metadata only, so the list
+# endpoints never touch them. Stored files are immutable: the GridFS _id is
+# the ETag, and a replacement is a new upload.
+
+ATTACHMENT_OWNERS = {"visitors": "visitors", "fleet": "fleet_trips"}
+ATTACHMENT_KINDS = ("photo", "document", "invoice")
+ATTACHMENT_TYPES = ("image/jpeg", "image/png", "image/webp", "application/pdf")
+ATTACHMENT_CHUNK_BYTES = 255 * 1024
+THUMBNAIL_SIZES = (128, 256, 512)
+
+def attachments_bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name="attachments", chunk_size_bytes=ATTACHMENT_CHUNK_BYTES)
+
+def attachment_public(file_doc: dict) -> dict:
+    meta = file_doc["metadata"]
+    return {
+        "id": str(file_doc["_id"]),
+        "filename": file_doc["filename"],
+        "kind": meta["kind"],
+        "content_type": meta["content_type"],
+        "length": file_doc["length"],
+        "uploaded_by": meta.get("uploaded_by"),
+        "uploaded_at": to_utc_iso(file_doc["uploadDate"])
+    }
+
+async def find_attachment(site_id: str, file_id: str) -> dict:
+    try:
+        oid = ObjectId(file_id)
+    except InvalidId:
+        raise HTTPException(status_code=404, detail="Anexo não encontrado")
+    file_doc = await db["attachments.files"].find_one({"_id": oid, "metadata.site_id": site_id})
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="Anexo não encontrado")
+    return file_doc
+
+def parse_byte_range(header: Optional[str], length: int) -> Optional[tuple]:
+    """Inclusive (start, end) for a single 'bytes=' range, or None to send the
+    whole file (no header, or a multi-range request we do not split)."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), int(last) if last else length - 1
+        else:
+            start, end = length - int(last), length - 1
+    except ValueError:
+        return None
+    start = max(start, 0)
+    if start >= length or start > end:
+        raise HTTPException(status_code=416, detail="Intervalo inválido", headers={"Content-Range": f"bytes */{length}"})
+    return start, min(end, length - 1)
+
+async def stream_attachment(file_id: ObjectId, start: int, end: int):
+    grid_out = await attachments_bucket().open_download_stream(file_id)
+    grid_out.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = await grid_out.read(min(remaining, ATTACHMENT_CHUNK_BYTES))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+def render_thumbnail(data: bytes, size: int) -> bytes:
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEG sources decode straight at a reduced scale
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        out = io.BytesIO()
+        image.convert("RGB").save(out, "JPEG", quality=80, optimize=True)
+    return out.getvalue()
+
+class ThumbnailCache:
+    """Rendered JPEG thumbnails per (file, size), bounded by total bytes.
+    Concurrent misses for the same key share one render, and at most
+    THUMBNAIL_WORKERS renders run at once, off the event loop."""
+
+    def __init__(self, max_bytes: int, workers: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.rendering = {}
+        self.semaphore = asyncio.Semaphore(workers)
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    async def get(self, file_id: ObjectId, size: int) -> bytes:
+        key = (file_id, size)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return self.entries[key]
+        task = self.rendering.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._render(key))
+            self.rendering[key] = task
+            task.add_done_callback(lambda _: self.rendering.pop(key, None))
+        # A disconnecting client must not cancel a render others are waiting on
+        return await asyncio.shield(task)
+
+    async def _render(self, key: tuple) -> bytes:
+        file_id, size = key
+        async with self.semaphore:
+            # The source is bounded by ATTACHMENT_MAX_BYTES; the decoder needs it whole
+            grid_out = await attachments_bucket().open_download_stream(file_id)
+            data = await grid_out.read()
+            thumbnail = await asyncio.to_thread(render_thumbnail, data, size)
+        self.entries[key] = thumbnail
+        self.bytes += len(thumbnail)
+        while self.bytes > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.stats["evictions"] += 1
+        return thumbnail
+
+    def discard(self, file_id: ObjectId):
+        for key in [key for key in self.entries if key[0] == file_id]:
+            self.bytes -= len(self.entries.pop(key))
+
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_BYTES, THUMBNAIL_WORKERS)
+
+async def store_attachment(owner: str, owner_id: str, kind: str, filename: Optional[str], request: Request) -> dict:
+    user = await get_current_user(request)
+    if kind not in ATTACHMENT_KINDS:
+        raise HTTPException(status_code=400, detail="Tipo de anexo inválido")
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in ATTACHMENT_TYPES:
+        raise HTTPException(status_code=415, detail="Formato não suportado (use JPEG, PNG, WebP ou PDF)")
+    too_large = HTTPException(status_code=413, detail=f"Arquivo excede {ATTACHMENT_MAX_BYTES / (1024 * 1024):g} MB")
+    if int(request.headers.get("content-length") or 0) > ATTACHMENT_MAX_BYTES:
+        raise too_large
+    collection = ATTACHMENT_OWNERS[owner]
+    if not await db[collection].find_one({"site_id": user["site_id"], **id_filter(owner_id)}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Registro não encontrado")
+    metadata = {
+        "site_id": user["site_id"],
+        "owner": collection,
+        "owner_id": owner_id,
+        "kind": kind,
+        "content_type": content_type,
+        "uploaded_by": user["username"]
+    }
+    filename = (filename or "").strip() or f"{kind}-{owner_id}"
+    grid_in = attachments_bucket().open_upload_stream(filename, metadata=metadata)
+    # The body goes to GridFS chunk by chunk; it is never held in memory whole
+    length = 0
+    try:
+        async for chunk in request.stream():
+            length += len(chunk)
+            if length > ATTACHMENT_MAX_BYTES:
+                raise too_large
+            await grid_in.write(chunk)
+        if not length:
+            raise HTTPException(status_code=400, detail="Arquivo vazio")
+    except BaseException:
+        await grid_in.abort()
+        raise
+    await grid_in.close()
+    return attachment_public({"_id": grid_in._id, "filename": filename, "length": length, "uploadDate": grid_in.upload_date, "metadata": metadata})
+
+async def list_attachments(owner: str, owner_id: str, request: Request) -> list:
+    user = await get_current_user(request)
+    files = await db["attachments.files"].find(
+        {"metadata.site_id": user["site_id"], "metadata.owner": ATTACHMENT_OWNERS[owner], "metadata.owner_id": owner_id}
+    ).sort("uploadDate", 1).to_list(100)
+    return [attachment_public(f) for f in files]
+
+@api_router.post("/visitors/{visitor_id}/attachments")
+async def upload_visitor_attachment(visitor_id: str, request: Request, kind: str = "photo", filename: Optional[str] = None):
+    return await store_attachment("visitors", visitor_id, kind, filename, request)
+
+@api_router.get("/visitors/{visitor_id}/attachments")
+async def list_visitor_attachments(visitor_id: str, request: Request):
+    return await list_attachments("visitors", visitor_id, request)
+
+@api_router.post("/fleet/{trip_id}/attachments")
+async def upload_fleet_attachment(trip_id: str, request: Request, kind: str = "invoice", filename: Optional[str] = None):
+    return await store_attachment("fleet", trip_id, kind, filename, request)
+
+@api_router.get("/fleet/{trip_id}/attachments")
+async def list_fleet_attachments(trip_id: str, request: Request):
+    return await list_attachments("fleet", trip_id, request)
+
+@api_router.get("/attachments/{file_id}")
+async def download_attachment(file_id: str, request: Request):
+    user = await get_current_user(request)
+    file_doc = await find_attachment(user["site_id"], file_id)
+    etag = f'"{file_doc["_id"]}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "private, max-age=86400, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    length = file_doc["length"]
+    byte_range = None
+    if request.headers.get("if-range", etag) == etag:
+        byte_range = parse_byte_range(request.headers.get("range"), length)
+    start, end = byte_range or (0, length - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Disposition"] = f"inline; filename*=UTF-8''{quote(file_doc['filename'])}"
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    return StreamingResponse(
+        stream_attachment(file_doc["_id"], start, end),
+        status_code=206 if byte_range else 200,
+        media_type=file_doc["metadata"]["content_type"],
+        headers=headers
+    )
+
+@api_router.get("/attachments/{file_id}/thumbnail")
+async def attachment_thumbnail(file_id: str, request: Request, size: int = 256):
+    user = await get_current_user(request)
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"Tamanhos disponíveis: {', '.join(map(str, THUMBNAIL_SIZES))}")
+    file_doc = await find_attachment(user["site_id"], file_id)
+    if not file_doc["metadata"]["content_type"].startswith("image/"):
+        raise HTTPException(status_code=415, detail="Miniatura disponível apenas para imagens")
+    etag = f'"{file_doc["_id"]}-t{size}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    try:
+        thumbnail = await thumbnail_cache.get(file_doc["_id"], size)
+    except Exception as e:
+        logger.warning(f"Falha ao gerar miniatura de {file_id}: {e}")
+        raise HTTPException(status_code=422, detail="Imagem inválida")
+    return Response(content=thumbnail, media_type="image/jpeg", headers=headers)
+
+@api_router.delete("/attachments/{file_id}")
+async def delete_attachment(file_id: str, request: Request):
+    user = await get_current_user(request)
+    file_doc = await find_attachment(user["site_id"], file_id)
+    if user["role"] != "admin" and file_doc["metadata"].get("uploaded_by") != user["username"]:
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    await attachments_bucket().delete(file_doc["_id"])
+    thumbnail_cache.discard(file_doc["_id"])
+    return {"message": "Anexo removido"}
+
 # ─── Reports ──────────────────────────────────────────────────────────
 
-@api_router.get("/reports/daily")
-async def get_daily_report(request: Request, date: Optional[str] = None):
-    await get_current_user(request)
-    if not date:
-        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    visitors = await db.visitors.find({"entry_time": {"$regex": f"^{date}"}}, {"_id": 0}).to_list(1000)
-    fleet = await db.fleet_trips.find({"created_at": {"$regex": f"^{date}"}}, {"_id": 0}).to_list(1000)
-    schedules = await db.schedules.find({"visit_date": date}, {"_id": 0}).to_list(1000)
-    report_obs = await db.report_observations.find_one({"date": date}, {"_id": 0})
+async def build_daily_report(site_id: str, date: str) -> dict:
+    visitors = [decode_document("visitors", v) for v in await db.visitors.find({"site_id": site_id, **day_filter("entry_time", date)}, {"_id": 0}).to_list(1000)]
+    fleet = [decode_document("fleet_trips", f) for f in await db.fleet_trips.find({"site_id": site_id, **day_filter("created_at", date)}, {"_id": 0}).to_list(1000)]
+    schedules = await db.schedules.find({"site_id": site_id, "visit_date": date}, {"_id": 0}).to_list(1000)
+    schedules.extend(await series_cache.occurrences(site_id, date, date))
+    report_obs = await db.report_observations.find_one({"site_id": site_id, "date": date}, {"_id": 0})
     return {
         "date": date,
+        "site_id": site_id,
+        "summary": await build_report_summary(site_id, date),
         "visitors": visitors,
         "fleet": fleet,
         "schedules": schedules,
@@ -382,26 +2160,122 @@ async def get_daily_report(request: Request, date: Optional[str] = None):
         "porter_name": report_obs.get("porter_name", "") if report_obs else ""
     }
 
-@api_router.post("/reports/observation")
-async def save_report_observation(req: ReportObservation, request: Request, date: Optional[str] = None):
-    await get_current_user(request)
-    if not date:
-        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    await db.report_observations.update_one(
-        {"date": date},
-        {"$set": {"date": date, "observation": req.observation, "porter_name": req.porter_name, "updated_at": datetime.now(timezone.utc).isoformat()}},
-        upsert=True
-    )
-    return {"message": "Observação salva"}
+def _parse_date(field: str) -> dict:
+    # Accepts both legacy ISO strings and native dates
+    return {"$convert": {"input": field, "to": "date", "onError": None, "onNull": None}}
+
+def _schedule_due(timezone_name: str) -> dict:
+    return {"$dateFromString": {
+        "dateString": {"$concat": ["$visit_date", "T", "$visit_time"]},
+        "timezone": timezone_name, "onError": None, "onNull": None
+    }}
+
+def schedule_on_time(schedule: dict) -> bool:
+    due_at, completed_at = schedule_due_at(schedule), parse_iso(schedule.get("completed_at"))
+    return bool(due_at and completed_at and completed_at <= due_at + timedelta(minutes=ON_TIME_GRACE_MINUTES))
+
+async def build_report_summary(site_id: str, date: str) -> dict:
+    """Day totals in one round trip: visitors, trips and schedules are
+    unioned into a single stream and split again by one $facet stage."""
+    grace_ms = ON_TIME_GRACE_MINUTES * 60 * 1000
+    pipeline = [
+        {"$match": {"site_id": site_id, **day_filter("entry_time", date)}},
+        {"$project": {"_id": 0, "kind": {"$literal": "visitor"}, "entry_time": 1, "exit_time": 1}},
+        {"$unionWith": {"coll": "fleet_trips", "pipeline": [
+            {"$match": {"site_id": site_id, **day_filter("created_at", date)}},
+            {"$project": {"_id": 0, "kind": {"$literal": "trip"}, "vehicle": 1, "distance": 1, "status": 1}}
+        ]}},
+        {"$unionWith": {"coll": "schedules", "pipeline": [
+            {"$match": {"site_id": site_id, "visit_date": date}},
+            {"$project": {"_id": 0, "kind": {"$literal": "schedule"}, "visit_date": 1, "visit_time": 1, "status": 1, "completed_at": 1}}
+        ]}},
+        {"$facet": {
+            "visitors": [
+                {"$match": {"kind": "visitor"}},
+                {"$group": {
+                    "_id": None,
+                    "total": {"$sum": 1},
+                    "inside": {"$sum": {"$cond": [{"$eq": [{"$ifNull": ["$exit_time", None]}, None]}, 1, 0]}},
+                    "avg_stay_ms": {"$avg": {"$subtract": [_parse_date("$exit_time"), _parse_date("$entry_time")]}}
+                }}
+            ],
+            "vehicles": [
+                {"$match": {"kind": "trip"}},
+                {"$group": {
+                    "_id": "$vehicle",
+                    "trips": {"$sum": 1},
+                    "km": {"$sum": {"$ifNull": ["$distance", 0]}},
+                    "in_transit": {"$sum": {"$cond": [{"$in": ["$status", ["em_viagem", FLEET_STATUS_CODES["em_viagem"]]]}, 1, 0]}}
+                }},
+                {"$sort": {"_id": 1}}
+            ],
+            "schedules": [
+                {"$match": {"kind": "schedule"}},
+                {"$group": {
+                    "_id": None,
+                    "total": {"$sum": 1},
+                    "completed": {"$sum": {"$cond": [{"$eq": ["$status", "completed"]}, 1, 0]}},
+                    "on_time": {"$sum": {"$cond": [{"$and": [
+                        {"$gt": [_parse_date("$completed_at"), None]},
+                        {"$lte": [_parse_date("$completed_at"), {"$add": [_schedule_due(GATE_TIMEZONE.key), grace_ms]}]}
+                    ]}, 1, 0]}}
+                }}
+            ]
+        }}
+    ]
+    facets = (await db.visitors.aggregate(pipeline).to_list(1))[0]
+    visitors = facets["visitors"][0] if facets["visitors"] else {}
+    schedules = facets["schedules"][0] if facets["schedules"] else {}
+    occurrences = await series_cache.occurrences(site_id, date, date)
+    schedule_total = schedules.get("total", 0) + len(occurrences)
+    schedule_completed = schedules.get("completed", 0) + sum(1 for o in occurrences if o["status"] == "completed")
+    avg_stay_ms = visitors.get("avg_stay_ms")
+    return {
+        "visitors": {
+            "total": visitors.get("total", 0),
+            "inside": visitors.get("inside", 0),
+            "average_stay_minutes": round(avg_stay_ms / 60000, 1) if avg_stay_ms is not None else None
+        },
+        "fleet": {
+            "trips": sum(v["trips"] for v in facets["vehicles"]),
+            "in_transit": sum(v["in_transit"] for v in facets["vehicles"]),
+            "total_km": round(sum(v["km"] for v in facets["vehicles"]), 1),
+            "vehicles": [{"vehicle": v["_id"], "trips": v["trips"], "km": round(v["km"], 1)} for v in facets["vehicles"]]
+        },
+        "schedules": {
+            "total": schedule_total,
+            "completed": schedule_completed,
+            "pending": schedule_total - schedule_completed,
+            "on_time": schedules.get("on_time", 0) + sum(1 for o in occurrences if schedule_on_time(o))
+        }
+    }
 
-@api_router.get("/reports/export/excel")
-async def export_excel(request: Request, date: Optional[str] = None):
-    await get_current_user(request)
-    if not date:
-        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+def strip_report_rows(report: dict) -> dict:
+    return {k: v for k, v in report.items() if k not in ("visitors", "fleet", "schedules")}
+
+def summary_lines(summary: dict) -> list:
+    """(label, value) pairs shared by the Excel and PDF summary sections."""
+    v, f, s = summary["visitors"], summary["fleet"], summary["schedules"]
+    avg = f"{v['average_stay_minutes']} min" if v["average_stay_minutes"] is not None else "—"
+    lines = [
+        ("Visitas", v["total"]),
+        ("Ainda no local", v["inside"]),
+        ("Permanência média", avg),
+        ("Viagens", f["trips"]),
+        ("Veículos em viagem", f["in_transit"]),
+        ("KM rodados", f["total_km"]),
+        ("Agendamentos", s["total"]),
+        ("Agendamentos concluídos", s["completed"]),
+        ("Concluídos no horário", s["on_time"]),
+    ]
+    lines.extend((f"KM - {veh['vehicle']}", veh["km"]) for veh in f["vehicles"])
+    return lines
+
+def render_report_excel(report: dict) -> bytes:
     import openpyxl
     from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 
+    date = report["date"]
     wb = openpyxl.Workbook()
     ws = wb.active
     ws.title = "Relatório Diário"
@@ -423,8 +2297,23 @@ async def export_excel(request: Request, date: Optional[str] = None):
     ws[f'A{row}'].alignment = Alignment(horizontal='center')
     row += 2
 
+    # Summary
+    ws.merge_cells(f'A{row}:H{row}')
+    ws[f'A{row}'] = "RESUMO"
+    ws[f'A{row}'].font = sub_header_font
+    ws[f'A{row}'].fill = sub_header_fill
+    row += 1
+    for label, value in summary_lines(report["summary"]):
+        ws.cell(row=row, column=1, value=label).font = Font(bold=True)
+        ws.cell(row=row, column=2, value=value)
+        row += 1
+    row += 1
+
     # Visitors
-    visitors = await db.visitors.find({"entry_time": {"$regex": f"^{date}"}}, {"_id": 0}).to_list(1000)
+    visitors = report.get("visitors")
+    if visitors is None:
+        row = render_excel_observations(ws, row, report, sub_header_font, sub_header_fill)
+        return save_workbook(wb, ws)
     ws.merge_cells(f'A{row}:H{row}')
     ws[f'A{row}'] = "VISITANTES"
     ws[f'A{row}'].font = sub_header_font
@@ -448,7 +2337,7 @@ async def export_excel(request: Request, date: Optional[str] = None):
     row += 1
 
     # Fleet
-    fleet = await db.fleet_trips.find({"created_at": {"$regex": f"^{date}"}}, {"_id": 0}).to_list(1000)
+    fleet = report["fleet"]
     ws.merge_cells(f'A{row}:H{row}')
     ws[f'A{row}'] = "CONTROLE DE FROTA"
     ws[f'A{row}'].font = sub_header_font
@@ -470,44 +2359,42 @@ async def export_excel(request: Request, date: Optional[str] = None):
         row += 1
     row += 1
 
-    # Observations
-    report_obs = await db.report_observations.find_one({"date": date}, {"_id": 0})
+    render_excel_observations(ws, row, report, sub_header_font, sub_header_fill)
+    return save_workbook(wb, ws)
+
+def render_excel_observations(ws, row: int, report: dict, sub_header_font, sub_header_fill) -> int:
+    from openpyxl.styles import Font
+
     ws.merge_cells(f'A{row}:H{row}')
     ws[f'A{row}'] = "OBSERVAÇÕES DO DIA"
     ws[f'A{row}'].font = sub_header_font
     ws[f'A{row}'].fill = sub_header_fill
     row += 1
     ws.merge_cells(f'A{row}:H{row}')
-    ws[f'A{row}'] = report_obs.get("observation", "Nenhuma observação") if report_obs else "Nenhuma observação"
+    ws[f'A{row}'] = report["observation"] or "Nenhuma observação"
     row += 2
     ws[f'A{row}'] = "Porteiro responsável:"
     ws[f'A{row}'].font = Font(bold=True)
-    ws[f'B{row}'] = report_obs.get("porter_name", "—") if report_obs else "—"
+    ws[f'B{row}'] = report["porter_name"] or "—"
+    return row + 1
 
+def save_workbook(wb, ws) -> bytes:
     # Adjust column widths
     for col in range(1, 9):
         ws.column_dimensions[chr(64+col)].width = 20
 
     output = io.BytesIO()
     wb.save(output)
-    output.seek(0)
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename=relatorio_{date}.xlsx"}
-    )
+    return output.getvalue()
 
-@api_router.get("/reports/export/pdf")
-async def export_pdf(request: Request, date: Optional[str] = None):
-    await get_current_user(request)
-    if not date:
-        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+def render_report_pdf(report: dict) -> bytes:
     from reportlab.lib import colors
     from reportlab.lib.pagesizes import A4, landscape
     from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
     from reportlab.platypus import SimpleDocTemplate, Table as RLTable, TableStyle, Paragraph, Spacer
     from reportlab.lib.units import cm
 
+    date = report["date"]
     output = io.BytesIO()
     doc = SimpleDocTemplate(output, pagesize=landscape(A4), topMargin=1*cm, bottomMargin=1*cm)
     styles = getSampleStyleSheet()
@@ -517,8 +2404,23 @@ async def export_pdf(request: Request, date: Optional[str] = None):
     elements.append(Paragraph(f"RELATÓRIO DIÁRIO - PORTARIA - {date}", title_style))
     elements.append(Spacer(1, 12))
 
+    # Summary
+    elements.append(Paragraph("RESUMO", styles['Heading2']))
+    s_table = RLTable([[label, str(value)] for label, value in summary_lines(report["summary"])], hAlign='LEFT')
+    s_table.setStyle(TableStyle([
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ]))
+    elements.append(s_table)
+    elements.append(Spacer(1, 18))
+
     # Visitors
-    visitors = await db.visitors.find({"entry_time": {"$regex": f"^{date}"}}, {"_id": 0}).to_list(1000)
+    visitors = report.get("visitors")
+    if visitors is None:
+        render_pdf_observations(elements, report, styles)
+        doc.build(elements)
+        return output.getvalue()
     elements.append(Paragraph("VISITANTES", styles['Heading2']))
     v_data = [["Nome", "Documento", "Entrada", "Saída", "Placa", "Empresa", "NF", "Obs."]]
     for v in visitors:
@@ -539,7 +2441,7 @@ async def export_pdf(request: Request, date: Optional[str] = None):
     elements.append(Spacer(1, 18))
 
     # Fleet
-    fleet = await db.fleet_trips.find({"created_at": {"$regex": f"^{date}"}}, {"_id": 0}).to_list(1000)
+    fleet = report["fleet"]
     elements.append(Paragraph("CONTROLE DE FROTA", styles['Heading2']))
     f_data = [["Motorista", "Veículo", "Destino", "NF", "KM Saída", "KM Entrada", "Dist. (KM)", "Status"]]
     for f in fleet:
@@ -558,34 +2460,302 @@ async def export_pdf(request: Request, date: Optional[str] = None):
     elements.append(t2)
     elements.append(Spacer(1, 18))
 
-    # Observations
-    report_obs = await db.report_observations.find_one({"date": date}, {"_id": 0})
+    render_pdf_observations(elements, report, styles)
+    doc.build(elements)
+    return output.getvalue()
+
+def render_pdf_observations(elements: list, report: dict, styles):
+    from reportlab.platypus import Paragraph, Spacer
+
     elements.append(Paragraph("OBSERVAÇÕES DO DIA", styles['Heading2']))
-    obs_text = report_obs.get("observation", "Nenhuma observação") if report_obs else "Nenhuma observação"
+    obs_text = report["observation"] or "Nenhuma observação"
     elements.append(Paragraph(obs_text, styles['Normal']))
     elements.append(Spacer(1, 12))
-    porter = report_obs.get("porter_name", "—") if report_obs else "—"
+    porter = report["porter_name"] or "—"
     elements.append(Paragraph(f"<b>Porteiro responsável:</b> {porter}", styles['Normal']))
 
-    doc.build(elements)
-    output.seek(0)
+REPORT_SNAPSHOT_FORMAT = 1
+
+class ReportSnapshotter:
+    """Freezes closed (UTC) days of every site into `report_snapshots`, keyed
+    by (site_id, date): the report JSON plus pre-rendered XLSX and PDF. Runs
+    shortly after midnight and re-freezes any day a late edit marked stale.
+    `edits` guards against an edit landing while a freeze is in flight: the
+    freeze only clears `stale` if `edits` is unchanged. Snapshots of another
+    REPORT_SNAPSHOT_FORMAT are re-frozen."""
+
+    def __init__(self):
+        self._dirty = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @staticmethod
+    def is_closed(date: str) -> bool:
+        return date < datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+    async def mark_stale(self, site_id: str, date: Optional[str]):
+        if not date or not self.is_closed(date):
+            return
+        await db.report_snapshots.update_one({"site_id": site_id, "date": date}, {"$set": {"stale": True}, "$inc": {"edits": 1}}, upsert=True)
+        self._dirty.add((site_id, date))
+        self._wakeup.set()
+
+    async def get(self, site_id: str, date: str, field: str):
+        if not self.is_closed(date):
+            return None
+        snapshot = await db.report_snapshots.find_one(
+            {"site_id": site_id, "date": date, "stale": False, "format": REPORT_SNAPSHOT_FORMAT}, {"_id": 0, field: 1}
+        )
+        return snapshot.get(field) if snapshot else None
+
+    async def freeze(self, site_id: str, date: str):
+        self._dirty.discard((site_id, date))
+        existing = await db.report_snapshots.find_one({"site_id": site_id, "date": date}, {"_id": 0, "edits": 1})
+        edits = existing.get("edits", 0) if existing else 0
+        report = await build_daily_report(site_id, date)
+        xlsx = await asyncio.to_thread(render_report_excel, report)
+        pdf = await asyncio.to_thread(render_report_pdf, report)
+        try:
+            await db.report_snapshots.update_one(
+                {"site_id": site_id, "date": date, "edits": edits},
+                {"$set": {"site_id": site_id, "date": date, "report": report, "xlsx": xlsx, "pdf": pdf, "stale": False, "edits": edits,
+                          "format": REPORT_SNAPSHOT_FORMAT,
+                          "frozen_at": now_iso()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            logger.info(f"Relatório {site_id}/{date} editado durante o congelamento, será refeito")
+            self._dirty.add((site_id, date))
+
+    async def freeze_pending(self):
+        today = datetime.now(timezone.utc).date()
+        recent = [(today - timedelta(days=n)).isoformat() for n in range(1, SNAPSHOT_BACKFILL_DAYS + 1)]
+        frozen = await db.report_snapshots.find(
+            {"date": {"$in": recent}, "stale": False, "format": REPORT_SNAPSHOT_FORMAT}, {"_id": 0, "site_id": 1, "date": 1}
+        ).to_list(None)
+        frozen = {(s["site_id"], s["date"]) for s in frozen}
+        wanted = {(site_id, date) for site_id in await known_sites() for date in recent}
+        for site_id, date in sorted((wanted - frozen) | self._dirty):
+            try:
+                await self.freeze(site_id, date)
+            except Exception as e:
+                logger.error(f"Falha ao congelar relatório {site_id}/{date}: {e}")
+
+    async def _run(self):
+        while True:
+            await self.freeze_pending()
+            now = datetime.now(timezone.utc)
+            next_freeze = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), timezone.utc) + timedelta(minutes=SNAPSHOT_DELAY_MINUTES)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=(next_freeze - now).total_seconds())
+                # Let a burst of late edits settle before re-rendering
+                await asyncio.sleep(SNAPSHOT_REFREEZE_DELAY_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+report_snapshotter = ReportSnapshotter()
+
+async def load_daily_report(site_id: str, date: str) -> dict:
+    snapshot = await report_snapshotter.get(site_id, date, "report")
+    return snapshot or await build_daily_report(site_id, date)
+
+async def load_report_summary(site_id: str, date: str) -> dict:
+    """The report without its row lists: a stripped snapshot, or the summary
+    aggregation plus the observation - never the rows themselves."""
+    snapshot = await report_snapshotter.get(site_id, date, "report")
+    if snapshot:
+        return strip_report_rows(snapshot)
+    report_obs = await db.report_observations.find_one({"site_id": site_id, "date": date}, {"_id": 0})
+    return {
+        "date": date,
+        "site_id": site_id,
+        "summary": await build_report_summary(site_id, date),
+        "observation": report_obs.get("observation", "") if report_obs else "",
+        "porter_name": report_obs.get("porter_name", "") if report_obs else ""
+    }
+
+@api_router.get("/reports/daily")
+async def get_daily_report(request: Request, date: Optional[str] = None, include_rows: bool = True):
+    user = await get_current_user(request)
+    site_id = user["site_id"]
+    if not date:
+        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if not include_rows:
+        return await load_report_summary(site_id, date)
+    return await load_daily_report(site_id, date)
+
+@api_router.post("/reports/observation")
+async def save_report_observation(req: ReportObservation, request: Request, date: Optional[str] = None):
+    user = await get_current_user(request)
+    if not date:
+        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    await db.report_observations.update_one(
+        {"site_id": user["site_id"], "date": date},
+        {"$set": {"site_id": user["site_id"], "date": date, "observation": req.observation, "porter_name": req.porter_name, "updated_at": now_iso()}},
+        upsert=True
+    )
+    await report_snapshotter.mark_stale(user["site_id"], date)
+    return {"message": "Observação salva"}
+
+@api_router.get("/reports/export/excel")
+async def export_excel(request: Request, date: Optional[str] = None, include_rows: bool = True):
+    user = await get_current_user(request)
+    if not date:
+        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if not include_rows:
+        content = await asyncio.to_thread(render_report_excel, await load_report_summary(user["site_id"], date))
+    else:
+        content = await report_snapshotter.get(user["site_id"], date, "xlsx")
+    if content is None:
+        content = await asyncio.to_thread(render_report_excel, await build_daily_report(user["site_id"], date))
     return StreamingResponse(
-        output,
+        io.BytesIO(content),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename=relatorio_{date}.xlsx"}
+    )
+
+@api_router.get("/reports/export/pdf")
+async def export_pdf(request: Request, date: Optional[str] = None, include_rows: bool = True):
+    user = await get_current_user(request)
+    if not date:
+        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if not include_rows:
+        content = await asyncio.to_thread(render_report_pdf, await load_report_summary(user["site_id"], date))
+    else:
+        content = await report_snapshotter.get(user["site_id"], date, "pdf")
+    if content is None:
+        content = await asyncio.to_thread(render_report_pdf, await build_daily_report(user["site_id"], date))
+    return StreamingResponse(
+        io.BytesIO(content),
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename=relatorio_{date}.pdf"}
     )
 
-# ─── Dashboard Stats ─────────────────────────────────────────────────
+# ─── Bulk Export ──────────────────────────────────────────────────────
+#
+# Full-history dumps for warehouse loads. The collection is streamed in _id
+# order and every row carries its _id, so an interrupted transfer resumes with
+# `after=<last _id received>`; `limit` ends a request after that many rows
+# without a pre-scan, the cursor simply stops.
+
+BULK_EXPORT_COLLECTIONS = ("visitors", "fleet_trips")
+BULK_EXPORT_FORMATS = ("ndjson", "csv")
+BULK_EXPORT_BATCH = 2000
+BULK_EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+class ExportEncoder:
+    """Stored documents to NDJSON or CSV bytes, optionally as one gzip member
+    across the whole response. Called once per batch from a worker thread."""
+
+    def __init__(self, collection: str, fmt: str, compress: bool):
+        self.collection = collection
+        self.fmt = fmt
+        self.columns = ("_id",) + COMPACT_FIELD_ORDER[collection] + ("site_id", "updated_at", "version")
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        self.started = False
+
+    def row(self, doc: dict) -> dict:
+        doc = dict(doc)
+        return {"_id": str(doc.pop("_id")), **decode_document(self.collection, doc)}
+
+    def encode(self, docs: list) -> bytes:
+        out = io.StringIO()
+        if self.fmt == "csv":
+            writer = csv.DictWriter(out, fieldnames=self.columns, extrasaction="ignore", lineterminator="\n")
+            if not self.started:
+                writer.writeheader()
+            writer.writerows(self.row(d) for d in docs)
+        else:
+            for d in docs:
+                out.write(json.dumps(self.row(d), ensure_ascii=False, default=str))
+                out.write("\n")
+        self.started = True
+        data = out.getvalue().encode("utf-8")
+        return self.compressor.compress(data) if self.compressor else data
+
+    def finish(self) -> bytes:
+        tail = b"" if self.started else self.encode([])
+        return tail + (self.compressor.flush() if self.compressor else b"")
+
+async def stream_bulk_export(collection: str, query: dict, limit: int, encoder: ExportEncoder):
+    cursor = db[collection].find(query).sort("_id", 1).batch_size(BULK_EXPORT_BATCH)
+    if limit:
+        cursor = cursor.limit(limit)
+    while True:
+        docs = await cursor.to_list(BULK_EXPORT_BATCH)
+        if not docs:
+            break
+        yield await asyncio.to_thread(encoder.encode, docs)
+    yield await asyncio.to_thread(encoder.finish)
+
+@api_router.get("/reports/export/bulk/{collection}")
+async def bulk_export(collection: str, request: Request, format: str = "ndjson", gzip: bool = False,
+                      since: int = 0, after: Optional[str] = None, limit: int = 0):
+    """The caller's site in _id order. `since` keeps only records changed
+    after that sync version; X-Export-Version is the version to pass as
+    `since` on the next incremental run (keep the first response's value
+    when resuming a run with `after`). `limit` 0 streams everything."""
+    user = await get_current_user(request)
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    if collection not in BULK_EXPORT_COLLECTIONS:
+        raise HTTPException(status_code=404, detail="Coleção não exportável")
+    if format not in BULK_EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Formato inválido (use ndjson ou csv)")
+    query = {"site_id": user["site_id"]}
+    if since:
+        query["version"] = {"$gt": since}
+    if after:
+        try:
+            query["_id"] = {"$gt": ObjectId(after)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Parâmetro after inválido")
+    # Read before the walk: anything written meanwhile is picked up again by the next run
+    version = version_reservations.ceiling(version_reservations.highest)
+
+    filename = f"{collection}_{user['site_id']}.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        stream_bulk_export(collection, query, max(0, limit), ExportEncoder(collection, format, gzip)),
+        media_type="application/gzip" if gzip else BULK_EXPORT_MEDIA_TYPES[format],
+        headers={
+            "X-Export-Version": str(version),
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Access-Control-Expose-Headers": "X-Export-Version"
+        }
+    )
 
-@api_router.get("/dashboard/stats")
-async def get_dashboard_stats(request: Request):
-    await get_current_user(request)
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    active_visitors = await db.visitors.count_documents({"exit_time": None})
-    today_visitors = await db.visitors.count_documents({"entry_time": {"$regex": f"^{today}"}})
-    today_schedules = await db.schedules.count_documents({"visit_date": today, "status": "pending"})
-    active_trips = await db.fleet_trips.count_documents({"status": "em_viagem"})
-    today_trips = await db.fleet_trips.count_documents({"created_at": {"$regex": f"^{today}"}})
+# ─── Dashboard ────────────────────────────────────────────────────────
+
+DASHBOARD_SCHEDULE_FIELDS = {"id": 1, "visitor_name": 1, "company": 1, "visit_time": 1}
+DASHBOARD_VISITOR_FIELDS = {"id": 1, "name": 1, "document": 1, "entry_time": 1, "date_micros": 1}
+DASHBOARD_ACTIVE_VISITORS = 5
+
+def dashboard_days() -> tuple:
+    """(UTC day, local day): visitor/trip counts use the first, schedules the second."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d"), local_today()
+
+async def dashboard_stats(site_id: str) -> dict:
+    today, local = dashboard_days()
+
+    async def pending_schedules():
+        count = await db.schedules.count_documents({"site_id": site_id, "visit_date": local, "status": "pending"})
+        return count + sum(1 for o in await series_cache.occurrences(site_id, local, local) if o["status"] == "pending")
+
+    active_visitors, today_visitors, today_schedules, active_trips, today_trips = await asyncio.gather(
+        db.visitors.count_documents({"site_id": site_id, "exit_time": None}),
+        db.visitors.count_documents({"site_id": site_id, **day_filter("entry_time", today)}),
+        pending_schedules(),
+        db.fleet_trips.count_documents({"site_id": site_id, "status": fleet_status_filter("em_viagem")}),
+        db.fleet_trips.count_documents({"site_id": site_id, **day_filter("created_at", today)})
+    )
     return {
         "active_visitors": active_visitors,
         "today_visitors": today_visitors,
@@ -594,6 +2764,44 @@ async def get_dashboard_stats(request: Request):
         "today_trips": today_trips
     }
 
+async def dashboard_version(site_id: str) -> str:
+    """Changes whenever a synced collection is written or either day the stats count on rolls over."""
+    counter = await db.counters.find_one({"_id": "sync_version"})
+    today, local = dashboard_days()
+    return f'"{site_id}-{today}-{local}-{counter["seq"] if counter else 0}"'
+
+@api_router.get("/dashboard/stats")
+async def get_dashboard_stats(request: Request):
+    user = await get_current_user(request)
+    return await dashboard_stats(user["site_id"])
+
+@api_router.get("/dashboard/bootstrap")
+async def get_dashboard_bootstrap(request: Request):
+    """Everything the dashboard renders, in one round trip.
+
+    The version is read before the data, so a write that lands mid-request
+    yields a newer tag on the next load; a matching If-None-Match skips the
+    queries entirely.
+    """
+    user = await get_current_user(request)
+    site_id = user["site_id"]
+    version = await dashboard_version(site_id)
+    headers = {"ETag": version, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == version:
+        return Response(status_code=304, headers=headers)
+
+    async def active_visitors():
+        visitors = await db.visitors.find({"site_id": site_id, "exit_time": None}, {"_id": 0, **DASHBOARD_VISITOR_FIELDS}).sort("entry_time", -1).to_list(DASHBOARD_ACTIVE_VISITORS)
+        return [decode_document("visitors", v) for v in visitors]
+
+    stats, schedules, visitors = await asyncio.gather(
+        dashboard_stats(site_id), pending_today_schedules(site_id, DASHBOARD_SCHEDULE_FIELDS), active_visitors()
+    )
+    return JSONResponse(
+        {"version": version.strip('"'), "stats": stats, "today_schedules": schedules, "active_visitors": visitors},
+        headers=headers
+    )
+
 # ─── Settings ─────────────────────────────────────────────────────────
 
 @api_router.get("/settings")
@@ -611,11 +2819,71 @@ async def save_settings(req: ServerConfig, request: Request):
         raise HTTPException(status_code=403, detail="Apenas administradores podem alterar configurações")
     await db.app_settings.update_one(
         {"key": "server_config"},
-        {"$set": {"key": "server_config", "server_ip": req.server_ip, "server_port": req.server_port, "backend_port": req.backend_port, "updated_at": datetime.now(timezone.utc).isoformat()}},
+        {"$set": {"key": "server_config", "server_ip": req.server_ip, "server_port": req.server_port, "backend_port": req.backend_port, "updated_at": now_iso()}},
         upsert=True
     )
     return {"message": "Configurações salvas com sucesso"}
 
+# ─── Sync ─────────────────────────────────────────────────────────────
+
+@api_router.get("/sync")
+async def sync_changes(request: Request, since: int = 0, limit: int = 500):
+    """Changes of the caller's site with version > since, oldest first; resume with the returned checkpoint."""
+    user = await get_current_user(request)
+    limit = max(1, min(limit, 2000))
+    # Versions above the ceiling may still have a lower one in flight; they come on the next call
+    ceiling = version_reservations.ceiling(version_reservations.highest)
+    query = {"site_id": user["site_id"], "version": {"$gt": since, "$lte": ceiling}}
+    entries = []
+    for name in SYNC_COLLECTIONS:
+        docs = await db[name].find(query, {"_id": 0}).sort("version", 1).to_list(limit + 1)
+        entries.extend((d["version"], name, decode_document(name, d)) for d in docs)
+    tombstones = await db.sync_tombstones.find(query, {"_id": 0}).sort("version", 1).to_list(limit + 1)
+    entries.extend((t["version"], None, t) for t in tombstones)
+    entries.sort(key=lambda e: e[0])
+    page = entries[:limit]
+
+    changes = {name: [] for name in SYNC_COLLECTIONS}
+    deleted = []
+    for version, name, doc in page:
+        if name is None:
+            deleted.append(doc)
+        else:
+            changes[name].append(doc)
+    return {
+        "since": since,
+        "checkpoint": page[-1][0] if page else since,
+        "has_more": len(entries) > limit,
+        "changes": changes,
+        "deleted": deleted
+    }
+
+# ─── Health ───────────────────────────────────────────────────────────
+
+@api_router.get("/health")
+async def health():
+    """Readiness probe: Mongo round trip plus event-loop lag; 503 when Mongo is unreachable."""
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout=2)
+        mongo = {"ok": True, "ping_ms": round((time.perf_counter() - started) * 1000, 1)}
+    except Exception as e:
+        mongo = {"ok": False, "error": str(e) or type(e).__name__}
+    lag = loop_watchdog.lag_snapshot()
+    body = {
+        "status": "ok" if mongo["ok"] and lag["p99_ms"] < LOOP_LAG_THRESHOLD_MS else ("degraded" if mongo["ok"] else "down"),
+        "mongo": mongo,
+        "loop_lag": lag
+    }
+    return JSONResponse(body, status_code=200 if mongo["ok"] else 503)
+
+@api_router.get("/health/blocking")
+async def get_blocking_incidents(request: Request):
+    user = await get_current_user(request)
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    return {"threshold_ms": LOOP_LAG_THRESHOLD_MS, "incidents": list(reversed(loop_watchdog.incidents))}
+
 # ─── Root ─────────────────────────────────────────────────────────────
 
 @api_router.get("/")
@@ -634,4 +2902,10 @@ app.add_middleware(
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    loop_watchdog.stop()
+    visit_scheduler.stop()
+    report_snapshotter.stop()
+    schema_migrator.stop()
+    if insert_coalescer:
+        await insert_coalescer.drain()
     client.close()
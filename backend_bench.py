@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import requests
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class GatekeeperBenchmark:
+    def __init__(self, base_url="https://visitor-fleet-log.preview.emergentagent.com"):
+        self.base_url = f"{base_url}/api"
+        self.token = None
+
+    def login(self, username="admin", password="admin123"):
+        response = requests.post(f"{self.base_url}/auth/login", json={"username": username, "password": password})
+        response.raise_for_status()
+        self.token = response.json()['token']
+
+    def headers(self):
+        return {'Content-Type': 'application/json', 'Authorization': f'Bearer {self.token}'}
+
+    def _timed(self, method, endpoint, data=None):
+        started = time.perf_counter()
+        response = requests.request(method, f"{self.base_url}{endpoint}", json=data, headers=self.headers())
+        return response.status_code, time.perf_counter() - started
+
+    @staticmethod
+    def percentile(samples, pct):
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def report(self, name, results, elapsed):
+        latencies = [lat for code, lat in results if code == 200]
+        errors = len(results) - len(latencies)
+        print(f"\n📈 {name}")
+        print(f"   Requests: {len(results)}  Errors: {errors}  Elapsed: {elapsed:.2f}s")
+        print(f"   Throughput: {len(results) / elapsed:.1f} req/s")
+        print(f"   p50: {self.percentile(latencies, 50) * 1000:.1f} ms  "
+              f"p99: {self.percentile(latencies, 99) * 1000:.1f} ms")
+        return latencies
+
+    def bench_checkin_burst(self, total=500, concurrency=50):
+        """Burst of check-ins as at shift start. Run once with WRITE_COALESCING=false
+        and once with WRITE_COALESCING=true on the server to compare."""
+        def checkin(i):
+            if i % 2:
+                return self._timed('POST', '/fleet', {
+                    "driver_name": f"Bench Driver {i}", "vehicle": f"BEN-{i:04d}", "departure_km": 1000 + i
+                })
+            return self._timed('POST', '/visitors', {
+                "name": f"Bench Visitor {i}", "document": f"BENCH{i:06d}", "company": "Benchmark"
+            })
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(checkin, range(total)))
+        return self.report("Check-in burst", results, time.perf_counter() - started)
+
+    def bench_checkin_under_login_flood(self, total=200, flood=400, concurrency=20):
+        """Check-in latency while bad-password logins hammer /auth/login."""
+        def bad_login(i):
+            started = time.perf_counter()
+            response = requests.post(f"{self.base_url}/auth/login",
+                                     json={"username": "admin", "password": f"wrong{i}"})
+            return response.status_code, time.perf_counter() - started
+
+        def checkin(i):
+            return self._timed('POST', '/visitors', {"name": f"Flood Visitor {i}", "document": f"FLOOD{i:06d}"})
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency * 2) as pool:
+            flood_future = pool.submit(lambda: list(ThreadPoolExecutor(max_workers=concurrency).map(bad_login, range(flood))))
+            results = list(pool.map(checkin, range(total)))
+            flood_results = flood_future.result()
+        rejected = sum(1 for code, _ in flood_results if code in (429, 503))
+        print(f"\n🔐 Login flood: {len(flood_results)} attempts, {rejected} shed before bcrypt")
+        return self.report("Check-ins during login flood", results, time.perf_counter() - started)
+
+    def bench_checkin_under_export_load(self, total=200, exports=40, concurrency=20, p99_factor=1.5, p99_slack_ms=50):
+        """Check-in latency while Excel/PDF exports and search scans saturate the heavy lanes.
+        Fails unless every check-in succeeds and the loaded p99 stays within
+        p99_factor x the unloaded p99 plus p99_slack_ms."""
+        baseline = [self._timed('POST', '/visitors', {"name": f"Baseline Visitor {i}", "document": f"BASE{i:06d}"})
+                     for i in range(50)]
+        baseline_p99 = self.percentile([lat for code, lat in baseline if code == 200], 99) * 1000
+
+        def heavy(i):
+            endpoint = ('/reports/export/excel', '/reports/export/pdf', '/visitors?search=a')[i % 3]
+            return self._timed('GET', endpoint)
+
+        def checkin(i):
+            return self._timed('POST', '/visitors', {"name": f"Export Load Visitor {i}", "document": f"EXPL{i:06d}"})
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency * 2) as pool:
+            heavy_future = pool.submit(lambda: list(ThreadPoolExecutor(max_workers=concurrency).map(heavy, range(exports))))
+            results = list(pool.map(checkin, range(total)))
+            heavy_results = heavy_future.result()
+        shed = sum(1 for code, _ in heavy_results if code == 503)
+        print(f"\n📦 Heavy load: {len(heavy_results)} exports/searches, {shed} shed with 503")
+        lanes = requests.get(f"{self.base_url}/admission", headers=self.headers()).json().get("lanes", {})
+        for name, lane in lanes.items():
+            print(f"   {name}: peak queue {lane['peak_waiting']}  p99 wait {lane['wait_ms_p99']} ms")
+        latencies = self.report("Check-ins during export load", results, time.perf_counter() - started)
+        p99 = self.percentile(latencies, 99) * 1000
+        budget = baseline_p99 * p99_factor + p99_slack_ms
+        print(f"   Unloaded p99: {baseline_p99:.1f} ms  Budget: {budget:.1f} ms")
+        assert len(latencies) == len(results), f"{len(results) - len(latencies)} check-ins failed under export load"
+        assert p99 <= budget, f"Check-in p99 {p99:.1f} ms exceeded budget {budget:.1f} ms under export load"
+        return latencies
+
+    def bench_bulk_export(self, collection="visitors", fmt="ndjson", gzip=False):
+        """Full-collection export throughput in a single streamed response."""
+        size = rows = 0
+        params = {'format': fmt, 'gzip': str(gzip).lower()}
+        started = time.perf_counter()
+        response = requests.get(f"{self.base_url}/reports/export/bulk/{collection}", params=params,
+                                headers=self.headers(), stream=True)
+        response.raise_for_status()
+        for chunk in response.raw.stream(256 * 1024, decode_content=False):
+            size += len(chunk)
+            if not gzip:
+                rows += chunk.count(b"\n")
+        elapsed = time.perf_counter() - started
+        print(f"\n🗄️  Bulk export {collection} ({fmt}{', gzip' if gzip else ''})")
+        print(f"   Bytes: {size / 1e6:.1f} MB  Elapsed: {elapsed:.2f}s")
+        print(f"   Throughput: {size / 1e6 / elapsed:.1f} MB/s" + (f"  {rows / elapsed:.0f} rows/s" if not gzip else ""))
+        return size, elapsed
+
+if __name__ == "__main__":
+    bench = GatekeeperBenchmark(sys.argv[1]) if len(sys.argv) > 1 else GatekeeperBenchmark()
+    bench.login()
+    bench.bench_checkin_burst()
+    bench.bench_checkin_under_login_flood()
+    bench.bench_checkin_under_export_load()
+    bench.bench_bulk_export()
+    bench.bench_bulk_export(gzip=True)
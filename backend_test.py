@@ -4,6 +4,7 @@ import requests
 import sys
 import json
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 class GatekeeperAPITester:
     def __init__(self, base_url="https://visitor-fleet-log.preview.emergentagent.com"):
@@ -88,10 +89,45 @@ class GatekeeperAPITester:
         """Test token verification"""
         return self.run_test("Verify Token", "GET", "/auth/verify", 200)
 
+    def test_auth_limits(self):
+        """Test auth admission counters (Admin only)"""
+        success, limits = self.run_test("Auth Limits", "GET", "/auth/limits", 200)
+        if success:
+            print(f"   Admitted: {limits.get('admitted')}  Rejected (busy): {limits.get('rejected_busy')}")
+        return success
+
+    def test_admission_lanes(self):
+        """Test heavy-route lane counters (Admin only)"""
+        success, admission = self.run_test("Admission Lanes", "GET", "/admission", 200)
+        if success:
+            for name, lane in admission.get("lanes", {}).items():
+                print(f"   {name}: waiting {lane['waiting']}/{lane['queue_limit']}  p99 wait {lane['wait_ms_p99']} ms")
+        return success
+
+    def test_health(self):
+        """Test readiness probe and blocking incidents"""
+        success, health = self.run_test("Health", "GET", "/health", 200)
+        if success:
+            print(f"   Status: {health.get('status')}  Mongo ping: {health['mongo'].get('ping_ms')} ms  "
+                  f"Loop lag p99: {health['loop_lag']['p99_ms']} ms")
+            success, _ = self.run_test("Blocking Incidents", "GET", "/health/blocking", 200)
+        return success
+
     def test_dashboard_stats(self):
         """Test dashboard statistics"""
         return self.run_test("Dashboard Stats", "GET", "/dashboard/stats", 200)
 
+    def test_dashboard_bootstrap(self):
+        """Test combined dashboard payload"""
+        success, response = self.run_test("Dashboard Bootstrap", "GET", "/dashboard/bootstrap", 200)
+        if success:
+            if not {"version", "stats", "today_schedules", "active_visitors"} <= set(response):
+                print("❌ Bootstrap payload incomplete")
+                self.failed_tests.append("Dashboard Bootstrap: payload incomplete")
+                return False
+            print(f"   Version: {response['version']}")
+        return success
+
     def test_visitor_operations(self):
         """Test visitor CRUD operations"""
         print("\n📋 Testing Visitor Operations...")
@@ -112,6 +148,15 @@ class GatekeeperAPITester:
         
         visitor_id = visitor_response.get('id')
         
+        # Returning-visitor suggestions
+        success, suggestions = self.run_test("Suggest Visitors", "GET", "/visitors/suggest?q=abc1", 200)
+        if not success:
+            return False
+        if not any(s.get('document') == visitor_data['document'] for s in suggestions):
+            print("❌ New visitor missing from suggestions")
+            self.failed_tests.append("Suggest Visitors: new visitor missing from suggestions")
+            return False
+
         # List visitors
         success, _ = self.run_test("List All Visitors", "GET", "/visitors", 200)
         if not success:
@@ -133,10 +178,44 @@ class GatekeeperAPITester:
             success, _ = self.run_test(
                 "Checkout Visitor", "PUT", f"/visitors/{visitor_id}/checkout", 200
             )
-            return success
+            if not success:
+                return False
+
+        # Visit statistics from the denormalized profile
+        success, profile = self.run_test(
+            "Get Visitor Profile", "GET", f"/visitors/profile/{visitor_data['document']}", 200
+        )
+        if success:
+            print(f"   Visits: {profile.get('visit_count')}  Avg stay: {profile.get('average_stay_minutes')} min")
+        return success
         
         return True
 
+    def test_timestamp_round_trip(self):
+        """Test that local-offset and microsecond UTC entry_times come back exactly as sent"""
+        print("\n🕒 Testing Timestamp Round Trip...")
+        cases = (
+            ("Local Offset", "2026-10-18T22:30:00.123456-03:00", "2026-10-18"),
+            ("Microsecond UTC", "2026-10-18T12:30:00.123456+00:00", "2026-10-18"),
+        )
+        for name, entry_time, day in cases:
+            success, visitor = self.run_test(
+                f"Create Visitor With {name}", "POST", "/visitors", 200,
+                {"name": "Fuso Teste", "document": "11122233344", "entry_time": entry_time}
+            )
+            if not success:
+                return False
+            success, visitors = self.run_test(f"List Visitors On {name} Day", "GET", f"/visitors?date={day}", 200)
+            if not success:
+                return False
+            stored = next((v for v in visitors if v.get('id') == visitor.get('id')), None)
+            if not stored or stored.get('entry_time') != entry_time:
+                print(f"❌ entry_time changed: {stored.get('entry_time') if stored else 'missing from its day'}")
+                self.failed_tests.append(f"Timestamp Round Trip: {name} entry_time not returned as sent")
+                return False
+            self.run_test(f"Checkout {name} Visitor", "PUT", f"/visitors/{visitor['id']}/checkout", 200)
+        return True
+
     def test_schedule_operations(self):
         """Test schedule CRUD operations"""
         print("\n📅 Testing Schedule Operations...")
@@ -166,6 +245,11 @@ class GatekeeperAPITester:
         success, _ = self.run_test("List Today's Schedules", "GET", "/schedules/today", 200)
         if not success:
             return False
+
+        # Upcoming visits from the in-process scheduler
+        success, _ = self.run_test("List Upcoming Schedules", "GET", "/schedules/upcoming?minutes=120", 200)
+        if not success:
+            return False
         
         # Complete schedule
         if schedule_id:
@@ -179,7 +263,45 @@ class GatekeeperAPITester:
             success, _ = self.run_test(
                 "Delete Schedule", "DELETE", f"/schedules/{schedule_id}", 200
             )
-            return success
+            if not success:
+                return False
+
+        # Recurring series, expanded lazily
+        series_data = dict(schedule_data, recurrence={"frequency": "weekly", "weekdays": [0, 1, 2, 3, 4]})
+        success, series = self.run_test("Create Recurring Schedule", "POST", "/schedules", 200, series_data)
+        if not success:
+            return False
+        for name, bad in (("Date", {"visit_date": "19/10/2026"}), ("Interval", {"recurrence": {"frequency": "daily", "interval": 0}})):
+            success, _ = self.run_test(f"Reject Series With Invalid {name}", "POST", "/schedules", 400, dict(series_data, **bad))
+            if not success:
+                return False
+        success, _ = self.run_test("Reject Invalid Window", "GET", "/schedules?start=garbage", 400)
+        if not success:
+            return False
+        success, _ = self.run_test("Reject Oversized Window", "GET", "/schedules?start=2026-01-01&end=9999-12-31", 400)
+        if not success:
+            return False
+        for name, day, expected in (("Invalid", "garbage", 400), ("Non-Occurrence", "1999-01-01", 404)):
+            success, _ = self.run_test(
+                f"Reject {name} Occurrence Day", "PUT", f"/schedules/{series.get('id')}:{day}/complete", expected
+            )
+            if not success:
+                return False
+        start = schedule_data["visit_date"]
+        end = (datetime.now() + timedelta(days=8)).strftime("%Y-%m-%d")
+        success, window = self.run_test("List Schedule Window", "GET", f"/schedules?start={start}&end={end}", 200)
+        if not success:
+            return False
+        occurrences = [s for s in window if s.get('series_id') == series.get('id')]
+        print(f"   Occurrences expanded: {len(occurrences)}")
+        if occurrences:
+            success, _ = self.run_test(
+                "Cancel Occurrence", "DELETE", f"/schedules/{occurrences[0]['id']}", 200
+            )
+            if not success:
+                return False
+        success, _ = self.run_test("Delete Series", "DELETE", f"/schedules/{series.get('id')}", 200)
+        return success
         
         return True
 
@@ -239,6 +361,23 @@ class GatekeeperAPITester:
         success, _ = self.run_test("Get Daily Report", "GET", f"/reports/daily?date={today}", 200)
         if not success:
             return False
+
+        # Totals only, computed server-side
+        success, summary_only = self.run_test(
+            "Get Report Summary", "GET", f"/reports/daily?date={today}&include_rows=false", 200
+        )
+        if not success:
+            return False
+        if 'summary' not in summary_only or 'visitors' in summary_only:
+            print("❌ Summary-only report has wrong shape")
+            self.failed_tests.append("Get Report Summary: wrong shape")
+            return False
+
+        # Closed days are served from the nightly snapshot once frozen
+        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        success, _ = self.run_test("Get Closed Day Report", "GET", f"/reports/daily?date={yesterday}", 200)
+        if not success:
+            return False
         
         # Save report observation
         obs_data = {
@@ -275,6 +414,177 @@ class GatekeeperAPITester:
         
         return success
 
+    def test_sync_operations(self):
+        """Test delta sync endpoint"""
+        print("\n🔄 Testing Delta Sync...")
+
+        success, first_page = self.run_test("Sync From Zero", "GET", "/sync?since=0&limit=50", 200)
+        if not success:
+            return False
+        checkpoint = first_page.get('checkpoint', 0)
+        while first_page.get('has_more'):
+            success, first_page = self.run_test("Sync Next Page", "GET", f"/sync?since={checkpoint}&limit=50", 200)
+            if not success:
+                return False
+            checkpoint = first_page.get('checkpoint', checkpoint)
+
+        success, visitor = self.run_test(
+            "Create Visitor For Sync", "POST", "/visitors", 200,
+            {"name": "Sync Test", "document": "99988877766"}
+        )
+        if not success:
+            return False
+
+        success, delta = self.run_test("Sync Since Checkpoint", "GET", f"/sync?since={checkpoint}", 200)
+        if success:
+            ids = [v.get('id') for v in delta.get('changes', {}).get('visitors', [])]
+            if visitor.get('id') not in ids:
+                print("❌ New visitor missing from delta")
+                self.failed_tests.append("Sync Since Checkpoint: new visitor missing from delta")
+                return False
+            print(f"   Delta checkpoint: {delta.get('checkpoint')}")
+        return success
+
+    def test_sync_concurrent_writes(self):
+        """Test that polling /sync during concurrent check-ins never skips a record"""
+        print("\n🔀 Testing Sync Under Concurrent Writes...")
+        success, page = self.run_test("Sync Latest Checkpoint", "GET", "/sync?since=0&limit=2000", 200)
+        if not success:
+            return False
+        checkpoint = page.get('checkpoint', 0)
+        while page.get('has_more'):
+            success, page = self.run_test("Sync Next Page", "GET", f"/sync?since={checkpoint}&limit=2000", 200)
+            checkpoint = page.get('checkpoint', checkpoint)
+        auth = {'Content-Type': 'application/json', 'Authorization': f'Bearer {self.token}'}
+
+        def checkin(i):
+            response = requests.post(f"{self.base_url}/visitors", json={"name": f"Sync Race {i}", "document": f"RACE{i:05d}"}, headers=auth)
+            return response.json().get('id') if response.status_code == 200 else None
+
+        seen = set()
+
+        def poll():
+            nonlocal checkpoint
+            delta = requests.get(f"{self.base_url}/sync?since={checkpoint}&limit=2000", headers=auth).json()
+            seen.update(v['id'] for v in delta['changes']['visitors'])
+            checkpoint = delta['checkpoint']
+
+        self.tests_run += 1
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            futures = [pool.submit(checkin, i) for i in range(60)]
+            while not all(f.done() for f in futures):
+                poll()
+            created = {f.result() for f in futures} - {None}
+        poll()
+        missing = created - seen
+        if missing:
+            print(f"❌ Failed - {len(missing)} of {len(created)} visitors skipped by sync")
+            self.failed_tests.append(f"Sync Concurrent Writes: {len(missing)} records skipped")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Passed - {len(created)} concurrent check-ins all delivered")
+        return True
+
+    def test_bulk_export(self):
+        """Test bulk NDJSON export resumed with `after`, and CSV/gzip"""
+        print("\n🗄️  Testing Bulk Export...")
+        auth = {'Authorization': f'Bearer {self.token}'}
+        self.tests_run += 1
+        response = requests.get(f"{self.base_url}/reports/export/bulk/visitors", headers=auth)
+        if response.status_code != 200 or 'X-Export-Version' not in response.headers:
+            print(f"❌ Failed - Bulk export: {response.status_code}")
+            self.failed_tests.append(f"Bulk Export: full dump returned {response.status_code}")
+            return False
+        full = [json.loads(line)['_id'] for line in response.text.splitlines()]
+        resumed, after, requests_made = [], None, 0
+        while requests_made < 10000:
+            params = {'limit': 500, **({'after': after} if after else {})}
+            rows = [json.loads(line) for line in
+                    requests.get(f"{self.base_url}/reports/export/bulk/visitors", params=params, headers=auth).text.splitlines()]
+            requests_made += 1
+            if not rows:
+                break
+            resumed += [r['_id'] for r in rows]
+            after = rows[-1]['_id']
+        if resumed[:len(full)] != full:
+            self.failed_tests.append("Bulk Export: resuming with `after` did not reproduce the full dump")
+            return False
+        response = requests.get(f"{self.base_url}/reports/export/bulk/fleet_trips?format=csv&gzip=true", headers=auth)
+        if response.status_code != 200 or not response.content.startswith(b'\x1f\x8b'):
+            self.failed_tests.append(f"Bulk Export: gzip CSV failed ({response.status_code})")
+            return False
+        self.tests_passed += 1
+        print(f"✅ Passed - {len(full)} visitors, resumed in {requests_made} requests, gzip CSV")
+        success, _ = self.run_test("Bulk Export Bad After", "GET", "/reports/export/bulk/visitors?after=invalido", 400)
+        return success
+
+    def test_site_isolation(self):
+        """Test that another site's records are invisible (admin X-Site-Id)"""
+        print("\n🏭 Testing Site Isolation...")
+        site_headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {self.token}', 'X-Site-Id': 'test-site-b'}
+        self.tests_run += 1
+        response = requests.post(f"{self.base_url}/visitors", json={"name": "Site B Visitor", "document": "55544433322"}, headers=site_headers)
+        if response.status_code != 200 or response.json().get('site_id') != 'test-site-b':
+            print(f"❌ Failed - Create visitor in site B: {response.status_code}")
+            self.failed_tests.append("Site Isolation: create visitor in site B failed")
+            return False
+        visitor_id = response.json()['id']
+        success, visitors = self.run_test("List Visitors (Default Site)", "GET", "/visitors?active=true", 200)
+        if success and any(v.get('id') == visitor_id for v in visitors):
+            print("❌ Site B visitor leaked into the default site")
+            self.failed_tests.append("Site Isolation: site B visitor visible in default site")
+            return False
+        self.run_test("Checkout Across Sites", "PUT", f"/visitors/{visitor_id}/checkout", 404)
+        response = requests.put(f"{self.base_url}/visitors/{visitor_id}/checkout", headers=site_headers)
+        if response.status_code != 200:
+            self.failed_tests.append("Site Isolation: checkout in own site failed")
+            return False
+        self.tests_passed += 1
+        print("✅ Passed - Site B records isolated")
+        return success
+
+    def test_attachments(self):
+        """Test streamed attachment upload, ranged download and thumbnail"""
+        print("\n📎 Testing Attachments...")
+        success, visitor = self.run_test(
+            "Create Visitor For Attachment", "POST", "/visitors", 200, {"name": "Anexo Teste", "document": "99988877766"}
+        )
+        if not success:
+            return False
+        # Smallest valid PNG (1x1 pixel)
+        png = bytes.fromhex(
+            "89504e470d0a1a0a0000000d4948445200000001000000010802000000907753de"
+            "0000000c49444154789c63f8ffff3f0005fe02fe0def46b80000000049454e44ae426082"
+        )
+        auth = {'Authorization': f'Bearer {self.token}'}
+        self.tests_run += 1
+        response = requests.post(
+            f"{self.base_url}/visitors/{visitor['id']}/attachments?kind=photo&filename=teste.png",
+            data=png, headers={**auth, 'Content-Type': 'image/png'}
+        )
+        if response.status_code != 200 or response.json().get('length') != len(png):
+            print(f"❌ Failed - Upload attachment: {response.status_code}")
+            self.failed_tests.append("Attachments: upload failed")
+            return False
+        file_id = response.json()['id']
+        response = requests.get(f"{self.base_url}/attachments/{file_id}", headers={**auth, 'Range': 'bytes=0-7'})
+        if response.status_code != 206 or response.content != png[:8]:
+            print(f"❌ Failed - Ranged download: {response.status_code}")
+            self.failed_tests.append("Attachments: range request failed")
+            return False
+        response = requests.get(f"{self.base_url}/attachments/{file_id}", headers={**auth, 'If-None-Match': response.headers.get('ETag', '')})
+        if response.status_code != 304:
+            self.failed_tests.append(f"Attachments: expected 304 for matching ETag, got {response.status_code}")
+            return False
+        response = requests.get(f"{self.base_url}/attachments/{file_id}/thumbnail?size=128", headers=auth)
+        if response.status_code != 200 or response.headers.get('Content-Type') != 'image/jpeg':
+            self.failed_tests.append(f"Attachments: thumbnail failed ({response.status_code})")
+            return False
+        self.tests_passed += 1
+        print("✅ Passed - Upload, range, ETag and thumbnail")
+        success, _ = self.run_test("Delete Attachment", "DELETE", f"/attachments/{file_id}", 200)
+        return success
+
     def test_user_management(self):
         """Test user management operations (Admin only)"""
         print("\n👥 Testing User Management (Admin Operations)...")
@@ -359,12 +669,22 @@ class GatekeeperAPITester:
         # Run authenticated tests
         test_methods = [
             self.test_verify_token,
+            self.test_auth_limits,
+            self.test_admission_lanes,
+            self.test_health,
             self.test_dashboard_stats,
+            self.test_dashboard_bootstrap,
             self.test_visitor_operations,
+            self.test_timestamp_round_trip,
             self.test_schedule_operations,
             self.test_fleet_operations,
             self.test_report_operations,
             self.test_export_functions,
+            self.test_bulk_export,
+            self.test_sync_operations,
+            self.test_sync_concurrent_writes,
+            self.test_site_isolation,
+            self.test_attachments,
             self.test_user_management,
             self.test_auth_edge_cases,
         ]
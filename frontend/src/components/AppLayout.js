@@ -7,6 +7,7 @@ import {
   LayoutDashboard, Users, CalendarDays, Car, FileText,
   UserCog, LogOut, Shield, Bell, ChevronLeft, ChevronRight, Menu, X, Settings
 } from 'lucide-react';
+import { toast } from 'sonner';
 import axios from 'axios';
 
 const navItems = [
@@ -23,7 +24,7 @@ const adminItems = [
 ];
 
 export default function AppLayout({ children }) {
-  const { user, logout, authHeaders, API } = useAuth();
+  const { user, token, logout, authHeaders, API } = useAuth();
   const location = useLocation();
   const [collapsed, setCollapsed] = useState(false);
   const [mobileOpen, setMobileOpen] = useState(false);
@@ -38,10 +39,21 @@ export default function AppLayout({ children }) {
 
   useEffect(() => {
     checkNotifications();
-    const interval = setInterval(checkNotifications, 60000);
+    const interval = setInterval(checkNotifications, 300000);
     return () => clearInterval(interval);
   }, [checkNotifications]);
 
+  useEffect(() => {
+    if (!token) return undefined;
+    const source = new EventSource(`${API}/schedules/reminders/stream?authorization=${encodeURIComponent(`Bearer ${token}`)}`);
+    source.addEventListener('reminder', (e) => {
+      const { schedule } = JSON.parse(e.data);
+      toast.info(`${schedule.visitor_name} chega às ${schedule.visit_time}`, { description: schedule.company || undefined });
+      checkNotifications();
+    });
+    return () => source.close();
+  }, [API, token, checkNotifications]);
+
   useEffect(() => { setMobileOpen(false); }, [location.pathname]);
 
   const allItems = user?.role === 'admin' ? [...navItems, ...adminItems] : navItems;
@@ -16,7 +16,7 @@ export default function AdminPage() {
   const { authHeaders, API } = useAuth();
   const [users, setUsers] = useState([]);
   const [dialog, setDialog] = useState({ open: false, mode: 'create', user: null });
-  const [form, setForm] = useState({ username: '', password: '', name: '', role: 'porteiro' });
+  const [form, setForm] = useState({ username: '', password: '', name: '', role: 'porteiro', site_id: '' });
 
   const loadUsers = useCallback(async () => {
     try {
@@ -30,12 +30,12 @@ export default function AdminPage() {
   useEffect(() => { loadUsers(); }, [loadUsers]);
 
   const openCreate = () => {
-    setForm({ username: '', password: '', name: '', role: 'porteiro' });
+    setForm({ username: '', password: '', name: '', role: 'porteiro', site_id: '' });
     setDialog({ open: true, mode: 'create', user: null });
   };
 
   const openEdit = (user) => {
-    setForm({ username: user.username, password: '', name: user.name, role: user.role });
+    setForm({ username: user.username, password: '', name: user.name, role: user.role, site_id: user.site_id || '' });
     setDialog({ open: true, mode: 'edit', user });
   };
 
@@ -46,7 +46,7 @@ export default function AdminPage() {
           toast.error('Todos os campos são obrigatórios');
           return;
         }
-        await axios.post(`${API}/users`, form, { headers: authHeaders });
+        await axios.post(`${API}/users`, { ...form, site_id: form.site_id || undefined }, { headers: authHeaders });
         toast.success('Usuário criado com sucesso');
       } else {
         const updateData = {};
@@ -54,6 +54,7 @@ export default function AdminPage() {
         if (form.password) updateData.password = form.password;
         if (form.name) updateData.name = form.name;
         if (form.role) updateData.role = form.role;
+        if (form.site_id) updateData.site_id = form.site_id;
         await axios.put(`${API}/users/${dialog.user.id}`, updateData, { headers: authHeaders });
         toast.success('Usuário atualizado');
       }
@@ -109,6 +110,7 @@ export default function AdminPage() {
                 <TableHead className="font-medium text-slate-500 text-xs uppercase tracking-wide">Nome</TableHead>
                 <TableHead className="font-medium text-slate-500 text-xs uppercase tracking-wide">Usuário</TableHead>
                 <TableHead className="font-medium text-slate-500 text-xs uppercase tracking-wide">Perfil</TableHead>
+                <TableHead className="font-medium text-slate-500 text-xs uppercase tracking-wide">Unidade</TableHead>
                 <TableHead className="font-medium text-slate-500 text-xs uppercase tracking-wide">Ações</TableHead>
               </TableRow>
             </TableHeader>
@@ -128,6 +130,7 @@ export default function AdminPage() {
                       </Badge>
                     )}
                   </TableCell>
+                  <TableCell className="font-mono text-sm text-slate-600">{u.site_id}</TableCell>
                   <TableCell>
                     <div className="flex items-center gap-1">
                       <Button
@@ -214,6 +217,18 @@ export default function AdminPage() {
                 </SelectContent>
               </Select>
             </div>
+            <div className="space-y-2">
+              <Label className="text-xs font-bold uppercase tracking-wide text-slate-500">
+                Unidade {dialog.mode === 'create' && '(vazio = unidade atual)'}
+              </Label>
+              <Input
+                data-testid="admin-user-site-input"
+                placeholder="Ex.: planta-sul"
+                className="bg-white border-slate-300 font-mono"
+                value={form.site_id}
+                onChange={(e) => setForm({...form, site_id: e.target.value})}
+              />
+            </div>
           </div>
           <DialogFooter>
             <Button variant="outline" onClick={() => setDialog({ open: false, mode: 'create', user: null })}>
@@ -13,14 +13,10 @@ export default function DashboardPage() {
 
   const loadData = useCallback(async () => {
     try {
-      const [statsRes, schedulesRes, visitorsRes] = await Promise.all([
-        axios.get(`${API}/dashboard/stats`, { headers: authHeaders }),
-        axios.get(`${API}/schedules/today`, { headers: authHeaders }),
-        axios.get(`${API}/visitors?active=true`, { headers: authHeaders }),
-      ]);
-      setStats(statsRes.data);
-      setTodaySchedules(schedulesRes.data);
-      setRecentVisitors(visitorsRes.data.slice(0, 5));
+      const { data } = await axios.get(`${API}/dashboard/bootstrap`, { headers: authHeaders });
+      setStats(data.stats);
+      setTodaySchedules(data.today_schedules);
+      setRecentVisitors(data.active_visitors);
     } catch (err) {
       console.error('Dashboard load error', err);
     }
@@ -123,6 +123,26 @@ export default function ReportsPage() {
 
       {report && (
         <div className="space-y-6">
+          {/* Summary Section */}
+          {report.summary && (
+            <div className="grid gap-4 md:grid-cols-2 lg:grid-cols-4" data-testid="report-summary">
+              {[
+                { label: 'Visitas', value: report.summary.visitors.total, detail: `${report.summary.visitors.inside} ainda no local` },
+                { label: 'Permanência Média', value: report.summary.visitors.average_stay_minutes != null ? `${report.summary.visitors.average_stay_minutes} min` : '—', detail: 'visitas encerradas' },
+                { label: 'KM Rodados', value: report.summary.fleet.total_km, detail: `${report.summary.fleet.trips} viagens · ${report.summary.fleet.vehicles.length} veículos` },
+                { label: 'Agendamentos', value: `${report.summary.schedules.completed}/${report.summary.schedules.total}`, detail: `${report.summary.schedules.on_time} no horário` },
+              ].map((item) => (
+                <Card key={item.label} className="bg-white border border-slate-200 shadow-sm">
+                  <CardContent className="p-4">
+                    <p className="text-xs font-bold uppercase tracking-wide text-slate-500">{item.label}</p>
+                    <p className="text-2xl font-bold text-slate-900 mt-1 font-mono tabular-nums">{item.value}</p>
+                    <p className="text-xs text-slate-400 mt-1">{item.detail}</p>
+                  </CardContent>
+                </Card>
+              ))}
+            </div>
+          )}
+
           {/* Visitors Section */}
           <Card className="bg-white border border-slate-200 shadow-sm" data-testid="report-visitors-card">
             <CardHeader className="border-b border-slate-100 bg-slate-50/50 p-4">
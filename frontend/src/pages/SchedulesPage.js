@@ -9,17 +9,24 @@ import { Calendar } from '../components/ui/calendar';
 import { Popover, PopoverContent, PopoverTrigger } from '../components/ui/popover';
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '../components/ui/table';
 import { Textarea } from '../components/ui/textarea';
+import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '../components/ui/select';
 import { toast } from 'sonner';
 import { CalendarPlus, CalendarDays, Check, Trash2, CalendarIcon } from 'lucide-react';
 import axios from 'axios';
 import { format } from 'date-fns';
 import { ptBR } from 'date-fns/locale';
 
+const RECURRENCE_RULES = {
+  daily: { frequency: 'daily' },
+  weekdays: { frequency: 'weekly', weekdays: [0, 1, 2, 3, 4] },
+  weekly: { frequency: 'weekly' },
+};
+
 export default function SchedulesPage() {
   const { authHeaders, API } = useAuth();
   const [schedules, setSchedules] = useState([]);
   const [selectedDate, setSelectedDate] = useState(new Date());
-  const [form, setForm] = useState({ visitor_name: '', company: '', visit_date: '', visit_time: '', notes: '' });
+  const [form, setForm] = useState({ visitor_name: '', company: '', visit_date: '', visit_time: '', notes: '', repeat: 'none' });
   const [loading, setLoading] = useState(false);
   const [datePickerOpen, setDatePickerOpen] = useState(false);
 
@@ -50,9 +57,10 @@ export default function SchedulesPage() {
     }
     setLoading(true);
     try {
-      await axios.post(`${API}/schedules`, form, { headers: authHeaders });
+      const { repeat, ...payload } = form;
+      await axios.post(`${API}/schedules`, { ...payload, recurrence: RECURRENCE_RULES[repeat] || null }, { headers: authHeaders });
       toast.success('Agendamento criado com sucesso');
-      setForm({ visitor_name: '', company: '', visit_date: '', visit_time: '', notes: '' });
+      setForm({ visitor_name: '', company: '', visit_date: '', visit_time: '', notes: '', repeat: 'none' });
       loadSchedules();
     } catch (err) {
       toast.error('Erro ao criar agendamento');
@@ -175,6 +183,20 @@ export default function SchedulesPage() {
                     />
                   </div>
                 </div>
+                <div className="space-y-2">
+                  <Label className="text-xs font-bold uppercase tracking-wide text-slate-500">Repetição</Label>
+                  <Select value={form.repeat} onValueChange={(val) => setForm({...form, repeat: val})}>
+                    <SelectTrigger data-testid="schedule-repeat-select" className="bg-white border-slate-300">
+                      <SelectValue placeholder="Não repetir" />
+                    </SelectTrigger>
+                    <SelectContent>
+                      <SelectItem value="none">Não repetir</SelectItem>
+                      <SelectItem value="daily">Todos os dias</SelectItem>
+                      <SelectItem value="weekdays">Dias úteis (seg–sex)</SelectItem>
+                      <SelectItem value="weekly">Semanalmente</SelectItem>
+                    </SelectContent>
+                  </Select>
+                </div>
                 <div className="space-y-2">
                   <Label className="text-xs font-bold uppercase tracking-wide text-slate-500">Observações</Label>
                   <Textarea
@@ -230,7 +252,10 @@ export default function SchedulesPage() {
                 ) : (
                   schedules.map((s) => (
                     <TableRow key={s.id} className="hover:bg-slate-50/50">
-                      <TableCell className="font-medium text-slate-700">{s.visitor_name}</TableCell>
+                      <TableCell className="font-medium text-slate-700">
+                        {s.visitor_name}
+                        {s.series_id && <Badge className="border-transparent bg-blue-50 text-blue-700 ml-2">Recorrente</Badge>}
+                      </TableCell>
                       <TableCell className="text-sm text-slate-600">{s.company || '—'}</TableCell>
                       <TableCell className="font-mono text-sm tabular-nums text-slate-600">
                         {s.visit_date ? format(new Date(s.visit_date + 'T12:00:00'), 'dd/MM/yyyy') : '—'}
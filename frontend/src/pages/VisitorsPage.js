@@ -8,7 +8,7 @@ import { Badge } from '../components/ui/badge';
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '../components/ui/table';
 import { Textarea } from '../components/ui/textarea';
 import { toast } from 'sonner';
-import { UserPlus, LogOut, Clock, Building2, Car, FileText, Receipt, Search, X } from 'lucide-react';
+import { UserPlus, LogOut, Clock, Building2, Car, FileText, Receipt, Search, X, Paperclip } from 'lucide-react';
 import axios from 'axios';
 
 export default function VisitorsPage() {
@@ -19,6 +19,8 @@ export default function VisitorsPage() {
   const [isSearching, setIsSearching] = useState(false);
   const [form, setForm] = useState({ name: '', document: '', vehicle_plate: '', company: '', observation: '', invoice: '' });
   const [loading, setLoading] = useState(false);
+  const [lookupQuery, setLookupQuery] = useState('');
+  const [suggestions, setSuggestions] = useState([]);
 
   const loadVisitors = useCallback(async () => {
     try {
@@ -32,6 +34,33 @@ export default function VisitorsPage() {
 
   useEffect(() => { loadVisitors(); }, [loadVisitors]);
 
+  useEffect(() => {
+    if (lookupQuery.trim().length < 2) {
+      setSuggestions([]);
+      return;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        const res = await axios.get(`${API}/visitors/suggest?q=${encodeURIComponent(lookupQuery.trim())}`, { headers: authHeaders });
+        setSuggestions(res.data);
+      } catch (err) {
+        setSuggestions([]);
+      }
+    }, 150);
+    return () => clearTimeout(timer);
+  }, [lookupQuery, API, authHeaders]);
+
+  const handleLookupChange = (field, value) => {
+    setForm({...form, [field]: value});
+    setLookupQuery(value);
+  };
+
+  const applySuggestion = (s) => {
+    setForm({...form, name: s.name, document: s.document, company: s.company || '', vehicle_plate: s.vehicle_plate || ''});
+    setLookupQuery('');
+    setSuggestions([]);
+  };
+
   const handleSearch = async () => {
     if (!searchQuery.trim()) {
       setIsSearching(false);
@@ -68,6 +97,7 @@ export default function VisitorsPage() {
       await axios.post(`${API}/visitors`, form, { headers: authHeaders });
       toast.success('Visitante registrado com sucesso');
       setForm({ name: '', document: '', vehicle_plate: '', company: '', observation: '', invoice: '' });
+      setLookupQuery('');
       loadVisitors();
     } catch (err) {
       toast.error('Erro ao registrar visitante');
@@ -85,6 +115,19 @@ export default function VisitorsPage() {
     }
   };
 
+  const handleAttach = async (id, file) => {
+    if (!file) return;
+    const kind = file.type === 'application/pdf' ? 'document' : 'photo';
+    try {
+      await axios.post(`${API}/visitors/${id}/attachments?kind=${kind}&filename=${encodeURIComponent(file.name)}`, file, {
+        headers: { ...authHeaders, 'Content-Type': file.type }
+      });
+      toast.success('Anexo enviado');
+    } catch (err) {
+      toast.error(err.response?.data?.detail || 'Erro ao enviar anexo');
+    }
+  };
+
   const activeVisitors = visitors.filter(v => !v.exit_time);
   const displayData = isSearching ? searchResults : visitors;
 
@@ -117,13 +160,23 @@ export default function VisitorsPage() {
               <div className="grid gap-4 md:grid-cols-2">
                 <div className="space-y-2">
                   <Label className="text-xs font-bold uppercase tracking-wide text-slate-500">Nome *</Label>
-                  <Input data-testid="visitor-name-input" placeholder="Nome completo" className="bg-white border-slate-300" value={form.name} onChange={(e) => setForm({...form, name: e.target.value})} required />
+                  <Input data-testid="visitor-name-input" placeholder="Nome completo" className="bg-white border-slate-300" value={form.name} onChange={(e) => handleLookupChange('name', e.target.value)} autoComplete="off" required />
                 </div>
                 <div className="space-y-2">
                   <Label className="text-xs font-bold uppercase tracking-wide text-slate-500">Documento *</Label>
-                  <Input data-testid="visitor-document-input" placeholder="RG / CPF" className="bg-white border-slate-300" value={form.document} onChange={(e) => setForm({...form, document: e.target.value})} required />
+                  <Input data-testid="visitor-document-input" placeholder="RG / CPF" className="bg-white border-slate-300" value={form.document} onChange={(e) => handleLookupChange('document', e.target.value)} autoComplete="off" required />
                 </div>
               </div>
+              {suggestions.length > 0 && (
+                <div className="border border-slate-200 rounded-lg divide-y divide-slate-100 bg-white shadow-sm" data-testid="visitor-suggestions">
+                  {suggestions.map((s) => (
+                    <button key={s.document} type="button" data-testid={`visitor-suggestion-${s.document}`} className="w-full text-left px-3 py-2 hover:bg-blue-50 transition-colors" onClick={() => applySuggestion(s)}>
+                      <p className="text-sm font-medium text-slate-800">{s.name} <span className="font-mono text-xs text-slate-500">{s.document}</span></p>
+                      <p className="text-xs text-slate-400">{[s.company, s.vehicle_plate].filter(Boolean).join(' · ')}</p>
+                    </button>
+                  ))}
+                </div>
+              )}
               <div className="grid gap-4 md:grid-cols-2">
                 <div className="space-y-2">
                   <Label className="text-xs font-bold uppercase tracking-wide text-slate-500"><Car className="w-3 h-3 inline mr-1" strokeWidth={1.5} />Placa do Veículo</Label>
@@ -174,9 +227,17 @@ export default function VisitorsPage() {
                       </div>
                       <span className="font-mono text-xs text-slate-500 tabular-nums">{v.entry_time ? v.entry_time.slice(11, 16) : ''}</span>
                     </div>
-                    <Button data-testid={`checkout-button-${v.id}`} variant="outline" size="sm" className="w-full text-xs border-red-200 text-red-700 hover:bg-red-50 hover:text-red-800" onClick={() => handleCheckout(v.id)}>
-                      <LogOut className="w-3 h-3 mr-1" strokeWidth={1.5} />Registrar Saída
-                    </Button>
+                    <div className="flex gap-2">
+                      <Button data-testid={`checkout-button-${v.id}`} variant="outline" size="sm" className="flex-1 text-xs border-red-200 text-red-700 hover:bg-red-50 hover:text-red-800" onClick={() => handleCheckout(v.id)}>
+                        <LogOut className="w-3 h-3 mr-1" strokeWidth={1.5} />Registrar Saída
+                      </Button>
+                      <Button asChild data-testid={`attach-button-${v.id}`} variant="outline" size="sm" className="text-xs border-slate-200 text-slate-600 hover:bg-slate-100 cursor-pointer">
+                        <label>
+                          <Paperclip className="w-3 h-3 mr-1" strokeWidth={1.5} />Anexar
+                          <input type="file" accept="image/jpeg,image/png,image/webp,application/pdf" className="hidden" onChange={(e) => { handleAttach(v.id, e.target.files[0]); e.target.value = ''; }} />
+                        </label>
+                      </Button>
+                    </div>
                   </div>
                 ))}
               </div>